@@ -1,4 +1,4 @@
-from fastapi import FastAPI, Header, Body
+from fastapi import APIRouter, FastAPI, Header, Body
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 import fre_node.config as config
@@ -6,14 +6,16 @@ from fre_node.config import API_PORT
 from .validator import Validator
 from .mempool import Mempool
 from .ledger import Ledger
-from .state import State
+from .block import Block
+from .utils import compute_tx_id
 from .validator_set import load_validators
 from .ton_anchor import anchor_client
 import subprocess
+import threading
 from pathlib import Path
 import json
 import os
-from typing import Optional
+from typing import List, Optional, Union
 import base64
 import secrets
 from nacl.signing import SigningKey
@@ -24,28 +26,61 @@ import time
 import uvicorn
 
 
-# Instance FastAPI unique
-app = FastAPI(title="FRE_NODE API", version="1.0.0")
+# Routes déclarées sur un router : create_app() les monte sur une app FastAPI
+# branchée sur les composants vivants du node.
+router = APIRouter()
 
-# Autoriser le dashboard à appeler l'API (peut être restreint au LAN)
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+# Composants servis par l'API, liés par create_app() (une app par process).
+# `lock` est partagé avec la production de blocs et le handler P2P.
+ledger = None
+mempool = None
+state = None
+validator = None
+p2p = None
+announce_tx = None   # FRENode.announce_tx : gossip des tx acceptées par l'API
+lock = threading.RLock()
+
+
+def create_app(node=None) -> FastAPI:
+    """
+    Application FastAPI servant le Ledger, la Mempool et le State du node
+    (mêmes objets que la boucle de consensus, sous le même verrou).
+    Sans node (ex: `uvicorn fre_node.api:app`), l'API charge ses propres composants.
+    """
+    global ledger, mempool, state, validator, lock, p2p, announce_tx
+    if node is not None:
+        ledger, mempool, state, validator, lock = node.ledger, node.mempool, node.state, node.validator, node.lock
+        p2p, announce_tx = node.p2p, node.announce_tx
+    else:
+        ledger, mempool, validator = Ledger(), Mempool(), Validator()
+        state = validator.state
+
+    application = FastAPI(title="FRE_NODE API", version="1.0.0")
+    # Autoriser le dashboard à appeler l'API (peut être restreint au LAN)
+    application.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    application.include_router(router)
+    return application
+
+
+def __getattr__(name):
+    # compat `uvicorn fre_node.api:app` : app autonome construite au premier accès
+    if name == "app":
+        global app
+        app = create_app()
+        return app
+    raise AttributeError(name)
 
 
 def start_api():
-    import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=API_PORT)
+    uvicorn.run(create_app(), host="0.0.0.0", port=API_PORT)
 
 
-validator = Validator()
-mempool = Mempool()
-ledger = Ledger()
-state = State()
 validators_list = load_validators()
 VALIDATORS_FILE = config.VALIDATORS_FILE
 VALIDATOR_SECRET_FILE = config.VALIDATOR_SECRET_FILE
@@ -55,66 +90,134 @@ NODE_NAME = config.NODE_NAME
 #         ENDPOINTS STATUS
 # ===============================
 
-@app.get("/status")
+@router.get("/status")
 def status():
-    return {
-        "node": config.NODE_NAME,
-        "blocks": ledger.count_blocks(),
-        "mempool": mempool.count(),
-        "latest_block": ledger.get_latest_block(),
-        "system": {
-            "cpu": psutil.cpu_percent(),
-            "ram": psutil.virtual_memory().percent,
-            "os": platform.platform(),
-            "uptime_sec": time.time() - psutil.boot_time()
+    with lock:
+        return {
+            "node": config.NODE_NAME,
+            "blocks": ledger.count_blocks(),
+            "mempool": mempool.count(),
+            "latest_block": ledger.get_latest_block(),
+            "system": {
+                "cpu": psutil.cpu_percent(),
+                "ram": psutil.virtual_memory().percent,
+                "os": platform.platform(),
+                "uptime_sec": time.time() - psutil.boot_time()
+            }
         }
-    }
 
 # ===============================
 #         API v1 (versionnée)
 # ===============================
 
-@app.post("/v1/tx/submit")
-def v1_tx_submit(tx: dict):
-    if not validator.validate_transaction(tx):
-        return JSONResponse({"error": "Invalid transaction"}, status_code=400)
-    ok = mempool.add_transaction(tx)
-    if not ok:
-        return JSONResponse({"error": "Duplicate TX"}, status_code=409)
-    return {"status": "accepted", "mempool": mempool.count()}
+@router.post("/v1/tx/submit")
+def v1_tx_submit(payload: Union[dict, List[dict]] = Body(...)):
+    """
+    Une tx (objet) ou un lot (liste) : signatures vérifiées ensemble, puis
+    nonce/balance et ajout mempool tx par tx (un lot peut enchaîner les nonces).
+    """
+    txs = payload if isinstance(payload, list) else [payload]
+    # signatures hors verrou : seule la partie état/mempool est sérialisée avec le node
+    verdicts = validator.validate_transactions(txs)
+    results = []
+    with lock:
+        for tx, ok in zip(txs, verdicts):
+            if ok:
+                pending = mempool.next_nonce(tx.get("from"), validator.state.get_nonce(tx.get("from")))
+                ok = validator.check_state(tx, pending_nonce=pending)
+            if not ok:
+                results.append(({"error": "Invalid transaction"}, 400))
+            elif not mempool.add_transaction(tx):
+                # doublon, remplacement sans fee suffisante, quota émetteur ou pool pleine
+                results.append(({"error": "Rejected by mempool (duplicate, fee too low or sender quota)"}, 409))
+            else:
+                results.append(({"status": "accepted"}, 200))
+                if announce_tx:
+                    announce_tx(tx)
+        count = mempool.count()
+
+    if not isinstance(payload, list):
+        body, code = results[0]
+        if code != 200:
+            return JSONResponse(body, status_code=code)
+        return {"status": "accepted", "mempool": count}
+    return {
+        "results": [dict(body, tx_id=compute_tx_id(tx) if isinstance(tx, dict) else None) for (body, _), tx in zip(results, txs)],
+        "accepted": sum(1 for _, code in results if code == 200),
+        "mempool": count,
+    }
 
 
-@app.get("/v1/tx/{tx_hash}")
+@router.get("/v1/tx/{tx_hash}")
 def v1_tx_get(tx_hash: str):
-    # recherche dans la mempool et dans la chaîne
-    for entry in mempool.transactions:
-        if entry.get("id") == tx_hash:
+    """
+    Recherche par tx_id (compute_tx_id) : mempool puis index des tx incluses.
+    Une tx incluse est renvoyée avec sa preuve d'inclusion contre le merkle_root
+    du bloc (vérifiable avec utils.verify_merkle_proof).
+    """
+    with lock:
+        entry = mempool.get(tx_hash)
+        if entry:
             return {"status": "pending", "tx": entry.get("tx")}
-    chain = ledger.get_chain()
-    for blk in chain:
-        for tx in blk.get("txs", []):
-            # tx_id recalculable côté client si besoin ; ici on renvoie l'inclusion
-            if tx.get("hash") == tx_hash or tx.get("tx_id") == tx_hash:
-                return {"status": "included", "block": blk.get("index"), "tx": tx}
-    return JSONResponse({"error": "Transaction not found"}, status_code=404)
-
-
-@app.get("/v1/block/{height}")
+        found = ledger.find_tx(tx_hash)
+        if found:
+            blk, position = found
+            return {
+                "status": "included",
+                "block": blk.get("index"),
+                "block_hash": blk.get("hash"),
+                "position": position,
+                "tx": blk["txs"][position],
+                "merkle_root": blk.get("merkle_root"),
+                "proof": Block.merkle_proof(blk["txs"], position),
+            }
+        return JSONResponse({"error": "Transaction not found"}, status_code=404)
+
+
+@router.get("/v1/block/{height}")
 def v1_block(height: int):
-    blk = ledger.get_block(height)
-    return blk if blk else JSONResponse({"error": "Block not found"}, status_code=404)
+    with lock:
+        blk = ledger.get_block(height)
+        return blk if blk else JSONResponse({"error": "Block not found"}, status_code=404)
 
 
-@app.get("/v1/address/{addr}")
+@router.get("/v1/address/{addr}")
 def v1_address(addr: str):
-    return {
-        "address": addr,
-        "balance": state.get_balance(addr),
-        "nonce": state.get_nonce(addr)
-    }
+    with lock:
+        return {
+            "address": addr,
+            "balance": state.get_balance(addr),
+            "nonce": state.get_nonce(addr)
+        }
 
 
-@app.get("/v1/validators")
+@router.get("/v1/address/{addr}/proof")
+def v1_address_proof(addr: str, height: Optional[int] = None):
+    """
+    Balance/nonce + preuve d'inclusion contre le state_root du bloc `height`
+    (dernier bloc par défaut). Vérifiable avec utils.verify_state_proof.
+    """
+    with lock:
+        blk = ledger.get_latest_block() if height is None else ledger.get_block(height)
+        if not blk:
+            return JSONResponse({"error": "Block not found"}, status_code=404)
+        if config.STATE_ROOT_SMT_HEIGHT < 0 or blk["index"] < config.STATE_ROOT_SMT_HEIGHT:
+            return JSONResponse({"error": "state_root of this block is not a Merkle root"}, status_code=400)
+        tree = state.tree_at(blk.get("state_root", ""))
+        if tree is None:
+            return JSONResponse({"error": "State not retained for this height"}, status_code=404)
+        leaf = tree.get(addr)
+        return {
+            "address": addr,
+            "height": blk["index"],
+            "state_root": blk["state_root"],
+            "balance": leaf.balance if leaf else 0,
+            "nonce": leaf.nonce if leaf else 0,
+            "proof": tree.prove(addr),
+        }
+
+
+@router.get("/v1/validators")
 def v1_validators():
     expanded = []
     for v in validators_list:
@@ -123,19 +226,29 @@ def v1_validators():
     return {"validators": validators_list, "weighted_order": expanded}
 
 
-@app.get("/v1/anchor/status")
+@router.get("/v1/anchor/status")
 def v1_anchor_status():
     return anchor_client.status()
 
 
-@app.get("/v1/mempool")
+@router.get("/v1/mempool")
 def v1_mempool():
-    return mempool.list_transactions()
+    with lock:
+        return mempool.list_transactions()
 
 
-@app.get("/v1/mempool/stats")
+@router.get("/v1/mempool/stats")
 def v1_mempool_stats():
-    return mempool.stats()
+    with lock:
+        return mempool.stats()
+
+
+@router.get("/v1/p2p/peers")
+def v1_p2p_peers():
+    # compteurs tenus par la boucle P2P (lecture seule, sans verrou)
+    if p2p is None:
+        return {"peers": [], "bans": []}
+    return {"peers": p2p.peer_stats(), "bans": p2p.guard.bans()}
 
 # ===============================
 #          ADMIN (LOCAL)
@@ -145,13 +258,13 @@ REPO_ROOT = Path(__file__).resolve().parent.parent
 UPDATE_SCRIPT = REPO_ROOT / "update" / "update_node.sh"
 
 
-@app.get("/admin/token/status")
+@router.get("/admin/token/status")
 def admin_token_status():
     """Indique si un token admin est dÇ¸jÇÿ prÇ¸sent."""
     return {"set": bool(config.ADMIN_TOKEN)}
 
 
-@app.post("/admin/token/generate")
+@router.post("/admin/token/generate")
 def admin_token_generate():
     """
     GÇ¸nÇ¸re un token admin unique si aucun n'est encore configurÇ¸.
@@ -164,7 +277,7 @@ def admin_token_generate():
     return {"status": "created", "token": token}
 
 
-@app.post("/admin/update")
+@router.post("/admin/update")
 def admin_update(x_admin_token: str = Header(default="")):
     if config.ADMIN_TOKEN and x_admin_token != config.ADMIN_TOKEN:
         return JSONResponse({"error": "unauthorized"}, status_code=401)
@@ -195,7 +308,7 @@ def _systemctl(cmd: list):
         return 1, "", str(e)
 
 
-@app.get("/admin/status")
+@router.get("/admin/status")
 def admin_status(x_admin_token: str = Header(default="")):
     if config.ADMIN_TOKEN and x_admin_token != config.ADMIN_TOKEN:
         return JSONResponse({"error": "unauthorized"}, status_code=401)
@@ -217,7 +330,7 @@ def admin_status(x_admin_token: str = Header(default="")):
     }
 
 
-@app.post("/admin/service/restart")
+@router.post("/admin/service/restart")
 def admin_service_restart(
     payload: dict = Body(...),
     x_admin_token: str = Header(default="")
@@ -231,7 +344,7 @@ def admin_service_restart(
     return {"status": "ok" if code == 0 else "failed", "stdout": out, "stderr": err, "returncode": code}
 
 
-@app.post("/admin/validator")
+@router.post("/admin/validator")
 def admin_set_validator(
     payload: dict = Body(...),
     x_admin_token: str = Header(default="")
@@ -269,7 +382,7 @@ def admin_set_validator(
     return {"status": "ok", "validators": validators_data}
 
 
-@app.get("/admin/validator/info")
+@router.get("/admin/validator/info")
 def admin_validator_info(x_admin_token: str = Header(default="")):
     """
     Retourne les informations du validateur (nom, pubkey, stake) et l'état local (balance, nonce).
@@ -301,8 +414,8 @@ def admin_validator_info(x_admin_token: str = Header(default="")):
     return info
 
 
-@app.get("/admin/validator/generate")
-@app.post("/admin/validator/generate")
+@router.get("/admin/validator/generate")
+@router.post("/admin/validator/generate")
 def admin_validator_generate(x_admin_token: str = Header(default="")):
     """
     Génère une paire de clés Ed25519 côté nœud.
@@ -316,7 +429,7 @@ def admin_validator_generate(x_admin_token: str = Header(default="")):
     return {"public_key": pub_b64, "private_key": priv_b64}
 
 
-@app.post("/admin/wifi")
+@router.post("/admin/wifi")
 def admin_wifi(
     payload: dict = Body(...),
     x_admin_token: str = Header(default="")
@@ -381,7 +494,7 @@ def _read_wpa_sta_conf(path: str):
     return {"ssid": ssid, "password": psk, "country": country}
 
 
-@app.get("/admin/wifi_sta")
+@router.get("/admin/wifi_sta")
 def admin_wifi_sta_get(x_admin_token: str = Header(default="")):
     """Lit la configuration STA (wlan0_sta)."""
     if config.ADMIN_TOKEN and x_admin_token != config.ADMIN_TOKEN:
@@ -390,7 +503,7 @@ def admin_wifi_sta_get(x_admin_token: str = Header(default="")):
     return _read_wpa_sta_conf(WPA_STA_PATH)
 
 
-@app.post("/admin/wifi_sta")
+@router.post("/admin/wifi_sta")
 def admin_wifi_sta(
     payload: dict = Body(...),
     x_admin_token: str = Header(default="")
@@ -438,65 +551,74 @@ network={{
 #          LEGACY ROUTES
 # ===============================
 
-@app.get("/block/latest")
+@router.get("/block/latest")
 def latest_block():
-    return ledger.get_latest_block() or {}
+    with lock:
+        return ledger.get_latest_block() or {}
 
-@app.get("/block/{index}")
+@router.get("/block/{index}")
 def get_block(index: int):
-    blk = ledger.get_block(index)
-    return blk if blk else JSONResponse({"error": "Block not found"}, status_code=404)
+    with lock:
+        blk = ledger.get_block(index)
+        return blk if blk else JSONResponse({"error": "Block not found"}, status_code=404)
 
-@app.get("/blockchain")
+@router.get("/blockchain")
 def blockchain():
-    return ledger.get_chain()
+    with lock:
+        return ledger.get_chain()
 
-@app.get("/state")
+@router.get("/state")
 def get_state():
-    return {
-        "balances": state.balances,
-        "nonces": state.nonces
-    }
+    # copies prises sous le verrou : la réponse est sérialisée après sa libération
+    with lock:
+        return {
+            "balances": dict(state.balances),
+            "nonces": dict(state.nonces)
+        }
 
-@app.get("/balance/{address}")
+@router.get("/balance/{address}")
 def balance(address: str):
-    return {"address": address, "balance": state.get_balance(address)}
+    with lock:
+        return {"address": address, "balance": state.get_balance(address)}
 
-@app.get("/mempool")
+@router.get("/mempool")
 def mempool_content():
-    return mempool.list_transactions()
+    with lock:
+        return mempool.list_transactions()
 
 # ===============================
 #          HEALTH / METRICS
 # ===============================
 
-@app.get("/health")
+@router.get("/health")
 def health():
-    latest = ledger.get_latest_block() or {}
-    return {
-        "status": "ok",
-        "height": latest.get("index", 0),
-        "hash": latest.get("hash", ""),
-        "mempool": mempool.count(),
-        "validators": len(validators_list),
-    }
+    with lock:
+        latest = ledger.get_latest_block() or {}
+        return {
+            "status": "ok",
+            "height": latest.get("index", 0),
+            "hash": latest.get("hash", ""),
+            "mempool": mempool.count(),
+            "validators": len(validators_list),
+        }
 
-@app.get("/metrics")
+@router.get("/metrics")
 def metrics():
-    latest = ledger.get_latest_block() or {}
-    return {
-        "node": NODE_NAME,
-        "height": latest.get("index", 0),
-        "latest_hash": latest.get("hash", ""),
-        "mempool": {
-            "count": mempool.count(),
-        },
-        "validators": len(validators_list),
-        "system": {
-            "cpu_percent": psutil.cpu_percent(),
-            "ram_percent": psutil.virtual_memory().percent,
-            "uptime_sec": time.time() - psutil.boot_time(),
-        },
-    }
+    with lock:
+        latest = ledger.get_latest_block() or {}
+        return {
+            "node": NODE_NAME,
+            "height": latest.get("index", 0),
+            "latest_hash": latest.get("hash", ""),
+            "mempool": {
+                "count": mempool.count(),
+            },
+            "validators": len(validators_list),
+            "system": {
+                "cpu_percent": psutil.cpu_percent(),
+                "ram_percent": psutil.virtual_memory().percent,
+                "uptime_sec": time.time() - psutil.boot_time(),
+            },
+        }
 
 
@@ -1,7 +1,7 @@
 import hashlib
 import json
 
-from .utils import compute_tx_id
+from .utils import compute_tx_id, merkle_parent
 
 
 class Block:
@@ -30,26 +30,65 @@ class Block:
         self.block_signature = block_signature
         self.hash = self.compute_hash()
 
+    @classmethod
+    def from_dict(cls, blk: dict):
+        """Reconstruit un Block depuis sa forme dict (to_dict / bloc reçu en P2P)."""
+        return cls(
+            index=blk["index"],
+            timestamp=blk["timestamp"],
+            txs=blk["txs"],
+            prev_hash=blk["prev_hash"],
+            validator=blk["validator"],
+            state_root=blk.get("state_root", ""),
+            merkle_root=blk.get("merkle_root"),
+            block_signature=blk.get("block_signature"),
+            total_fees=blk.get("total_fees", 0),
+            block_reward=blk.get("block_reward", 0),
+        )
+
     @staticmethod
     def compute_merkle_root(txs):
         """
         Merkle root sur les tx_id (compute_tx_id), ordre préservé.
         """
-        if not txs:
-            return hashlib.sha256(b"").hexdigest()
+        return Block.merkle_root_from_ids([compute_tx_id(tx) for tx in txs])
 
-        layer = [compute_tx_id(tx) for tx in txs]
+    @staticmethod
+    def _merkle_layer(layer):
+        """Niveau suivant de l'arbre : paires hachées, dernier noeud dupliqué si impair."""
+        return [
+            merkle_parent(layer[i], layer[i + 1] if i + 1 < len(layer) else layer[i])
+            for i in range(0, len(layer), 2)
+        ]
+
+    @staticmethod
+    def merkle_root_from_ids(tx_ids):
+        """Merkle root à partir des tx_id déjà calculés."""
+        if not tx_ids:
+            return hashlib.sha256(b"").hexdigest()
 
+        layer = list(tx_ids)
         while len(layer) > 1:
-            next_layer = []
-            for i in range(0, len(layer), 2):
-                left = layer[i]
-                right = layer[i + 1] if i + 1 < len(layer) else layer[i]
-                combined = (left + right).encode()
-                next_layer.append(hashlib.sha256(combined).hexdigest())
-            layer = next_layer
+            layer = Block._merkle_layer(layer)
         return layer[0]
 
+    @staticmethod
+    def merkle_proof(txs, position: int):
+        """
+        Preuve d'inclusion de txs[position] : hashes frères des feuilles vers la racine
+        (même arbre que compute_merkle_root, dernier noeud dupliqué si impair).
+        Vérifiable avec utils.verify_merkle_proof.
+        """
+        layer = [compute_tx_id(tx) for tx in txs]
+        proof = []
+        idx = position
+        while len(layer) > 1:
+            sibling = idx ^ 1
+            proof.append(layer[sibling] if sibling < len(layer) else layer[idx])
+            layer = Block._merkle_layer(layer)
+            idx //= 2
+        return proof
+
     def compute_hash(self):
         """
         Hash déterministe du bloc (métadonnées uniquement, pas la liste TX brute).
@@ -0,0 +1,310 @@
+import json
+import os
+import struct
+import time
+import zlib
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+
+from .config import BLOCKS_DIR, BLOCK_SEGMENT_MAX_BYTES, BLOCK_FSYNC, BLOCK_FSYNC_INTERVAL_SEC
+
+# magic | height | payload length | crc32(payload)
+RECORD_MAGIC = b"FREB"
+RECORD_HEADER = struct.Struct("<4sQII")
+
+# index.dat : une entrée de taille fixe par height
+# segment | offset du payload | longueur | hash | prev_hash
+INDEX_ENTRY = struct.Struct("<IQI32s32s")
+INDEX_FILE = "index.dat"
+INDEX_READ_CHUNK = 4096
+
+
+def _segment_name(seg: int) -> str:
+    return f"seg-{seg:06d}.dat"
+
+
+def _hex32(value) -> bytes:
+    try:
+        raw = bytes.fromhex(value or "")
+    except ValueError:
+        return b"\x00" * 32
+    return raw if len(raw) == 32 else b"\x00" * 32
+
+
+class BlockStore:
+    """
+    Append-only block storage in rolling segment files.
+    Each block is one framed record (header + compact JSON payload); a torn
+    record at the tail (crash during append) is cut off when the store opens.
+    index.dat maps height -> (segment, offset, length, hash, prev_hash) with
+    fixed-size entries, so point reads never scan the segments.
+    """
+
+    def __init__(self, path: str = BLOCKS_DIR):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._count = 0
+        self._index = None
+        self._readers = {}
+        self._writer = None
+        self._active_seg = 0
+        self._active_size = 0
+        self._last_fsync = 0.0
+        self._recover()
+
+    # =====================================
+    # OPEN / RECOVERY
+    # =====================================
+
+    def _segments(self) -> List[int]:
+        segs = []
+        for p in self.path.glob("seg-*.dat"):
+            try:
+                segs.append(int(p.stem.split("-", 1)[1]))
+            except ValueError:
+                continue
+        return sorted(segs)
+
+    def _scan_segment(self, seg: int, start_offset: int = 0):
+        """
+        Yield (height, offset, payload) for every valid record of a segment.
+        Stops at the first torn or corrupt record; returns the end of valid data.
+        """
+        path = self.path / _segment_name(seg)
+        size = path.stat().st_size
+        offset = start_offset
+        with open(path, "rb") as f:
+            f.seek(offset)
+            while offset + RECORD_HEADER.size <= size:
+                header = f.read(RECORD_HEADER.size)
+                magic, height, length, crc = RECORD_HEADER.unpack(header)
+                if magic != RECORD_MAGIC or offset + RECORD_HEADER.size + length > size:
+                    break
+                payload = f.read(length)
+                if zlib.crc32(payload) != crc:
+                    break
+                yield height, offset + RECORD_HEADER.size, payload
+                offset += RECORD_HEADER.size + length
+        return offset
+
+    def _record_valid(self, height: int) -> bool:
+        """Check that an index entry points to an intact record of the same height."""
+        seg, offset, length, _, _ = self.entry(height)
+        path = self.path / _segment_name(seg)
+        if offset < RECORD_HEADER.size or not path.exists():
+            return False
+        if offset + length > path.stat().st_size:
+            return False
+        with open(path, "rb") as f:
+            f.seek(offset - RECORD_HEADER.size)
+            magic, rec_height, rec_length, crc = RECORD_HEADER.unpack(f.read(RECORD_HEADER.size))
+            if magic != RECORD_MAGIC or rec_height != height or rec_length != length:
+                return False
+            return zlib.crc32(f.read(length)) == crc
+
+    def _recover(self):
+        index_path = self.path / INDEX_FILE
+        if not index_path.exists():
+            index_path.touch()
+        self._index = open(index_path, "r+b")
+        self._count = index_path.stat().st_size // INDEX_ENTRY.size
+
+        # l'index peut être en avance sur les données (écritures non fsync) : on recule
+        while self._count > 0 and not self._record_valid(self._count - 1):
+            self._count -= 1
+        self._index.truncate(self._count * INDEX_ENTRY.size)
+
+        if self._count:
+            seg, offset, length, _, _ = self.entry(self._count - 1)
+            resume_seg, resume_offset = seg, offset + length
+        else:
+            segs = self._segments()
+            resume_seg, resume_offset = (segs[0] if segs else 0), 0
+
+        # indexe les enregistrements écrits après la dernière entrée (crash entre les deux écritures)
+        segs = [s for s in self._segments() if s >= resume_seg]
+        for pos, seg in enumerate(segs):
+            scanner = self._scan_segment(seg, resume_offset if seg == resume_seg else 0)
+            while True:
+                try:
+                    height, offset, payload = next(scanner)
+                except StopIteration as stop:
+                    valid_end = stop.value
+                    break
+                if height != self._count:
+                    valid_end = offset - RECORD_HEADER.size
+                    break
+                blk = json.loads(payload)
+                self._append_index(seg, offset, len(payload), blk)
+
+            path = self.path / _segment_name(seg)
+            if valid_end < path.stat().st_size:
+                print(f"[STORE] Torn tail in {path.name} at offset {valid_end}, truncating")
+                with open(path, "r+b") as f:
+                    f.truncate(valid_end)
+                    os.fsync(f.fileno())
+                # tout ce qui suit un enregistrement invalide est inutilisable
+                for later in segs[pos + 1:]:
+                    print(f"[STORE] Dropping segment {_segment_name(later)}")
+                    (self.path / _segment_name(later)).unlink()
+                segs = segs[: pos + 1]
+                break
+
+        self._active_seg = segs[-1] if segs else resume_seg
+        self._open_writer()
+        self.sync(force=True)
+
+    def _open_writer(self):
+        if self._writer:
+            self._writer.close()
+        path = self.path / _segment_name(self._active_seg)
+        self._writer = open(path, "ab")
+        self._active_size = self._writer.tell()
+
+    def _reader(self, seg: int):
+        fh = self._readers.get(seg)
+        if fh is None:
+            fh = open(self.path / _segment_name(seg), "rb")
+            self._readers[seg] = fh
+        return fh
+
+    def _close_readers(self):
+        for fh in self._readers.values():
+            fh.close()
+        self._readers = {}
+
+    # =====================================
+    # WRITE
+    # =====================================
+
+    def _append_index(self, seg: int, offset: int, length: int, blk: dict):
+        entry = INDEX_ENTRY.pack(seg, offset, length, _hex32(blk.get("hash")), _hex32(blk.get("prev_hash")))
+        self._index.seek(self._count * INDEX_ENTRY.size)
+        self._index.write(entry)
+        self._count += 1
+
+    def _fsync_dir(self):
+        try:
+            fd = os.open(self.path, os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _roll_segment(self):
+        self.sync(force=True)
+        self._active_seg += 1
+        self._open_writer()
+        if BLOCK_FSYNC != "never":
+            self._fsync_dir()
+
+    def append(self, blk: dict, sync: bool = True):
+        """Append a block at height count(); blk["index"] must match."""
+        height = self._count
+        if blk.get("index") != height:
+            raise ValueError(f"BlockStore expects height {height}, got {blk.get('index')}")
+
+        payload = json.dumps(blk, separators=(",", ":")).encode()
+        record = RECORD_HEADER.pack(RECORD_MAGIC, height, len(payload), zlib.crc32(payload)) + payload
+        if self._active_size > 0 and self._active_size + len(record) > BLOCK_SEGMENT_MAX_BYTES:
+            self._roll_segment()
+
+        offset = self._active_size
+        self._writer.write(record)
+        self._writer.flush()
+        self._active_size += len(record)
+        self._append_index(self._active_seg, offset + RECORD_HEADER.size, len(payload), blk)
+        if sync:
+            self.sync()
+
+    def sync(self, force: bool = False):
+        """Apply the fsync policy (BLOCK_FSYNC) to the active segment and the index."""
+        if not self._writer:
+            return
+        self._writer.flush()
+        self._index.flush()
+        if not force:
+            if BLOCK_FSYNC == "never":
+                return
+            if BLOCK_FSYNC == "interval" and time.time() - self._last_fsync < BLOCK_FSYNC_INTERVAL_SEC:
+                return
+        # données avant index : une entrée d'index ne doit pas survivre à son enregistrement
+        os.fsync(self._writer.fileno())
+        os.fsync(self._index.fileno())
+        self._last_fsync = time.time()
+
+    def truncate(self, height: int):
+        """Keep blocks 0..height (inclusive), drop everything after."""
+        keep = max(height + 1, 0)
+        if keep >= self._count:
+            return
+        seg, offset, _, _, _ = self.entry(keep)
+        cut = offset - RECORD_HEADER.size
+
+        self._close_readers()
+        self._writer.close()
+        self._writer = None
+        self._count = keep
+        self._index.truncate(keep * INDEX_ENTRY.size)
+        self._index.flush()
+        os.fsync(self._index.fileno())
+        for later in self._segments():
+            if later > seg:
+                (self.path / _segment_name(later)).unlink()
+        with open(self.path / _segment_name(seg), "r+b") as f:
+            f.truncate(cut)
+            os.fsync(f.fileno())
+
+        self._active_seg = seg
+        self._open_writer()
+
+    # =====================================
+    # READ
+    # =====================================
+
+    def count(self) -> int:
+        return self._count
+
+    def entry(self, height: int) -> Tuple[int, int, int, str, str]:
+        """(segment, offset, length, hash, prev_hash) of a height, read from index.dat."""
+        self._index.seek(height * INDEX_ENTRY.size)
+        seg, offset, length, h, prev = INDEX_ENTRY.unpack(self._index.read(INDEX_ENTRY.size))
+        return seg, offset, length, h.hex(), prev.hex()
+
+    def iter_entries(self, start: int = 0, end: Optional[int] = None) -> Iterator[Tuple[int, str, str]]:
+        """Stream (height, hash, prev_hash) from the index only, without decoding any block."""
+        stop = self._count if end is None else min(end, self._count)
+        height = max(start, 0)
+        while height < stop:
+            n = min(INDEX_READ_CHUNK, stop - height)
+            self._index.seek(height * INDEX_ENTRY.size)
+            chunk = self._index.read(n * INDEX_ENTRY.size)
+            for _, _, _, h, prev in INDEX_ENTRY.iter_unpack(chunk):
+                yield height, h.hex(), prev.hex()
+                height += 1
+
+    def read(self, height: int) -> Optional[dict]:
+        if not 0 <= height < self._count:
+            return None
+        seg, offset, length, _, _ = self.entry(height)
+        if seg == self._active_seg:
+            self._writer.flush()
+        fh = self._reader(seg)
+        fh.seek(offset)
+        return json.loads(fh.read(length))
+
+    def iter_blocks(self, start: int = 0, end: Optional[int] = None) -> Iterator[dict]:
+        """Stream blocks [start, end) one by one without keeping them in memory."""
+        stop = self._count if end is None else min(end, self._count)
+        for height in range(max(start, 0), stop):
+            yield self.read(height)
+
+    def close(self):
+        self.sync(force=True)
+        self._close_readers()
+        if self._writer:
+            self._writer.close()
+            self._writer = None
+        self._index.close()
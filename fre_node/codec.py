@@ -0,0 +1,229 @@
+import hashlib
+import json
+import struct
+from typing import Any, NamedTuple, Tuple
+
+# ===========================
+# CBOR DÉTERMINISTE (sous-ensemble RFC 8949)
+# ===========================
+# Encodage possible du payload des trames binaires P2P (voir plus bas) :
+# - entiers : en-tête le plus court, |n| < 2**64 (sinon ValueError)
+# - float : toujours float64 ; bytes, str UTF-8, listes, dicts à clés str
+# - longueurs définies uniquement, clés de map triées par encodage (bytewise)
+# Un même objet donne donc toujours les mêmes octets, sur tous les noeuds.
+
+_U8 = struct.Struct(">B")
+_U16 = struct.Struct(">H")
+_U32 = struct.Struct(">I")
+_U64 = struct.Struct(">Q")
+_F64 = struct.Struct(">d")
+
+
+def _head(major: int, n: int) -> bytes:
+    mt = major << 5
+    if n < 24:
+        return bytes((mt | n,))
+    if n < 0x100:
+        return bytes((mt | 24, n))
+    if n < 0x10000:
+        return bytes((mt | 25,)) + _U16.pack(n)
+    if n < 0x100000000:
+        return bytes((mt | 26,)) + _U32.pack(n)
+    if n < 0x10000000000000000:
+        return bytes((mt | 27,)) + _U64.pack(n)
+    raise ValueError("integer out of CBOR range")
+
+
+def _encode_key(key) -> bytes:
+    if not isinstance(key, str):
+        raise TypeError(f"map key must be str, got {type(key).__name__}")
+    raw = key.encode()
+    return _head(3, len(raw)) + raw
+
+
+def _encode(obj: Any, out: list):
+    # bool avant int (bool est une sous-classe d'int)
+    if obj is None:
+        out.append(b"\xf6")
+    elif obj is True:
+        out.append(b"\xf5")
+    elif obj is False:
+        out.append(b"\xf4")
+    elif isinstance(obj, int):
+        out.append(_head(0, obj) if obj >= 0 else _head(1, -1 - obj))
+    elif isinstance(obj, str):
+        raw = obj.encode()
+        out.append(_head(3, len(raw)))
+        out.append(raw)
+    elif isinstance(obj, dict):
+        out.append(_head(5, len(obj)))
+        for key_bytes, value in sorted((_encode_key(k), v) for k, v in obj.items()):
+            out.append(key_bytes)
+            _encode(value, out)
+    elif isinstance(obj, (list, tuple)):
+        out.append(_head(4, len(obj)))
+        for item in obj:
+            _encode(item, out)
+    elif isinstance(obj, float):
+        out.append(b"\xfb" + _F64.pack(obj))
+    elif isinstance(obj, (bytes, bytearray)):
+        out.append(_head(2, len(obj)))
+        out.append(bytes(obj))
+    else:
+        raise TypeError(f"cannot encode {type(obj).__name__}")
+
+
+def encode(obj: Any) -> bytes:
+    out = []
+    _encode(obj, out)
+    return b"".join(out)
+
+
+def _decode(data: bytes, pos: int) -> Tuple[Any, int]:
+    initial = data[pos]
+    major, info = initial >> 5, initial & 0x1F
+    pos += 1
+    if major == 7:
+        if info == 20:
+            return False, pos
+        if info == 21:
+            return True, pos
+        if info == 22:
+            return None, pos
+        if info == 27:
+            return _F64.unpack_from(data, pos)[0], pos + 8
+        raise ValueError(f"unsupported simple value {info}")
+
+    if info < 24:
+        n = info
+    elif info == 24:
+        n = data[pos]
+        pos += 1
+    elif info == 25:
+        n = _U16.unpack_from(data, pos)[0]
+        pos += 2
+    elif info == 26:
+        n = _U32.unpack_from(data, pos)[0]
+        pos += 4
+    elif info == 27:
+        n = _U64.unpack_from(data, pos)[0]
+        pos += 8
+    else:
+        raise ValueError("indefinite lengths are not supported")
+
+    if major == 0:
+        return n, pos
+    if major == 1:
+        return -1 - n, pos
+    if major == 3:
+        end = pos + n
+        if end > len(data):
+            raise ValueError("truncated string")
+        return data[pos:end].decode(), end
+    if major == 5:
+        obj = {}
+        for _ in range(n):
+            key, pos = _decode(data, pos)
+            if not isinstance(key, str):
+                raise ValueError("map key must be a string")
+            obj[key], pos = _decode(data, pos)
+        return obj, pos
+    if major == 4:
+        items = []
+        for _ in range(n):
+            item, pos = _decode(data, pos)
+            items.append(item)
+        return items, pos
+    if major == 2:
+        end = pos + n
+        if end > len(data):
+            raise ValueError("truncated bytes")
+        return data[pos:end], end
+    raise ValueError(f"unsupported major type {major}")
+
+
+def decode(data: bytes) -> Any:
+    """Décode un objet CBOR complet ; ValueError si tronqué, invalide ou suivi d'octets en trop."""
+    data = bytes(data)
+    try:
+        obj, pos = _decode(data, 0)
+    except (IndexError, struct.error, UnicodeDecodeError, RecursionError) as e:
+        raise ValueError(f"invalid CBOR: {e}") from e
+    if pos != len(data):
+        raise ValueError("trailing bytes after CBOR object")
+    return obj
+
+
+# ===========================
+# TRAME BINAIRE P2P (v1)
+# ===========================
+# magic "FRE" | version | codec du payload | longueur du type | ts | pubkey (32)
+# puis type | payload | signature Ed25519 (64).
+# La signature porte sur l'en-tête + type + sha256(payload) : rien n'est
+# re-sérialisé pour signer ou vérifier, le payload est haché tel que reçu.
+
+FRAME_MAGIC = b"FRE"
+FRAME_VERSION = 1
+_FRAME_HEAD = struct.Struct(">3sBBBQ32s")
+SIG_LEN = 64
+
+# nom annoncé dans HELLO -> identifiant dans la trame
+PAYLOAD_CODECS = {"json": 0, "cbor1": 1}
+_CODEC_NAMES = {v: k for k, v in PAYLOAD_CODECS.items()}
+
+
+class Frame(NamedTuple):
+    msg_type: str
+    ts: int
+    pubkey: bytes
+    codec: str
+    payload: bytes
+    signed: bytes      # octets couverts par la signature
+    signature: bytes
+
+
+def encode_payload(payload: Any, codec: str) -> bytes:
+    if codec == "cbor1":
+        return encode(payload)
+    return json.dumps(payload, separators=(",", ":")).encode()
+
+
+def decode_payload(data: bytes, codec: str) -> Any:
+    if codec == "cbor1":
+        return decode(data)
+    return json.loads(data)
+
+
+def _signed_bytes(head: bytes, payload: bytes) -> bytes:
+    return head + hashlib.sha256(payload).digest()
+
+
+def build_frame(msg_type: str, payload: bytes, ts: int, pubkey: bytes, codec: str, sign) -> bytes:
+    """Trame complète ; `sign(bytes) -> signature brute (64 octets)`."""
+    type_raw = msg_type.encode()
+    head = _FRAME_HEAD.pack(FRAME_MAGIC, FRAME_VERSION, PAYLOAD_CODECS[codec], len(type_raw), ts, pubkey) + type_raw
+    return head + payload + sign(_signed_bytes(head, payload))
+
+
+def parse_frame(data: bytes) -> Frame:
+    """Découpe une trame (signature non vérifiée) ; ValueError si malformée ou version inconnue."""
+    if len(data) < _FRAME_HEAD.size + SIG_LEN:
+        raise ValueError("frame too short")
+    magic, version, codec_id, type_len, ts, pubkey = _FRAME_HEAD.unpack_from(data)
+    if magic != FRAME_MAGIC or version != FRAME_VERSION or codec_id not in _CODEC_NAMES:
+        raise ValueError("unknown frame format")
+    body_start = _FRAME_HEAD.size + type_len
+    sig_start = len(data) - SIG_LEN
+    if body_start > sig_start:
+        raise ValueError("frame too short")
+    head = bytes(data[:body_start])
+    payload = bytes(data[body_start:sig_start])
+    return Frame(
+        msg_type=head[_FRAME_HEAD.size:].decode(),
+        ts=ts,
+        pubkey=pubkey,
+        codec=_CODEC_NAMES[codec_id],
+        payload=payload,
+        signed=_signed_bytes(head, payload),
+        signature=bytes(data[sig_start:]),
+    )
@@ -14,6 +14,35 @@ STATE_FILE = os.path.join(DATA_DIR, "state.json")
 CONFIG_FILE = os.path.join(DATA_DIR, "config.json")
 ADMIN_TOKEN_FILE = os.path.join(DATA_DIR, "admin_token.json")
 
+# ===========================
+# STOCKAGE DES BLOCS (segments append-only)
+# ===========================
+# chain.json n'est plus réécrit à chaque bloc : il est importé au premier démarrage
+# puis renommé en chain.json.imported.
+
+BLOCKS_DIR = os.path.join(DATA_DIR, "blocks")
+BLOCK_SEGMENT_MAX_BYTES = int(os.getenv("FRE_BLOCK_SEGMENT_MAX_BYTES", str(64 * 1024 * 1024)))
+# always : fsync à chaque bloc | interval : au plus une fois par intervalle | never : laissé à l'OS
+BLOCK_FSYNC = os.getenv("FRE_BLOCK_FSYNC", "always").lower()
+BLOCK_FSYNC_INTERVAL_SEC = float(os.getenv("FRE_BLOCK_FSYNC_INTERVAL", "1"))
+# Index tx_id -> (height, position) des transactions incluses (sqlite)
+TX_INDEX_FILE = os.path.join(BLOCKS_DIR, "txindex.sqlite")
+# Headers connus (chaîne locale + branches distantes) avec poids de stake cumulé (sqlite)
+HEADERS_FILE = os.path.join(BLOCKS_DIR, "headers.sqlite")
+# Nombre de blocs décodés gardés en mémoire (cache LRU du ledger)
+BLOCK_CACHE_SIZE = int(os.getenv("FRE_BLOCK_CACHE_SIZE", "256"))
+
+# Checkpoint "vérifié jusqu'au height H (hash X)" : au démarrage, les blocs <= H
+# ne subissent qu'un contrôle de chaînage. FRE_FULL_VERIFY / --full-verify force tout.
+CHECKPOINT_FILE = os.path.join(DATA_DIR, "checkpoint.json")
+CHECKPOINT_INTERVAL = int(os.getenv("FRE_CHECKPOINT_INTERVAL", "100"))
+FULL_VERIFY = os.getenv("FRE_FULL_VERIFY", "false").lower() in ("1", "true", "yes")
+
+# Vérification parallèle des blocs (signatures, merkle, fees) sur un pool de process
+VERIFY_WORKERS = int(os.getenv("FRE_VERIFY_WORKERS", str(os.cpu_count() or 1)))
+VERIFY_BATCH_SIZE = 512     # blocs lus puis vérifiés par lot au chargement
+VERIFY_PARALLEL_MIN = 8     # en dessous, vérification dans le process courant
+
 # ===========================
 # RÉSEAU
 # ===========================
@@ -33,10 +62,23 @@ INITIAL_BALANCE = 1000      # pour les nouveaux wallets
 # Rewards / fees
 BLOCK_REWARD = 0            # inflation optionnelle par bloc (0 = désactivé)
 
+# State root : hash JSON trié (format historique) jusqu'à ce height exclu, puis racine
+# d'un arbre de Merkle creux (mise à jour incrémentale). -1 = format historique partout.
+# Doit être identique sur tous les noeuds d'une même chaîne.
+STATE_ROOT_SMT_HEIGHT = int(os.getenv("FRE_STATE_ROOT_SMT_HEIGHT", "-1"))
+
 # Mempool
 MEMPOOL_FILE = os.path.join(DATA_DIR, "mempool.json")
 MEMPOOL_TTL_SEC = 600       # expire après 10 minutes
+MEMPOOL_EXPIRY_BUCKET_SEC = 1   # granularité de l'expiration (une tx expire au plus 1 s en retard)
 MEMPOOL_MAX_SIZE = 10000
+MEMPOOL_MAX_PER_SENDER = int(os.getenv("FRE_MEMPOOL_MAX_PER_SENDER", "64"))
+# Remplacement d'une tx (même from + nonce) si la nouvelle fee dépasse l'ancienne d'au moins X %
+MEMPOOL_RBF_BUMP_PCT = int(os.getenv("FRE_MEMPOOL_RBF_BUMP_PCT", "10"))
+# Journal append-only des ajouts/retraits, compacté dans mempool.json au-delà de
+# MEMPOOL_JOURNAL_COMPACT_OPS opérations (et au moins 2x la taille de la pool)
+MEMPOOL_JOURNAL_FILE = os.path.join(DATA_DIR, "mempool.journal")
+MEMPOOL_JOURNAL_COMPACT_OPS = int(os.getenv("FRE_MEMPOOL_JOURNAL_COMPACT_OPS", "5000"))
 
 # ===========================
 # VALIDATEUR PRINCIPAL (PoA / identité locale)
@@ -87,6 +129,8 @@ VALIDATOR_PRIVKEY_ENV = VALIDATOR_PRIVATE_KEY or os.getenv("FRE_VALIDATOR_PRIVKE
 TX_VERSION = "tx_v1"
 CHAIN_ID = "fre-local"
 MIN_FEE = 1
+# tx_id dont la signature a déjà été vérifiée (gossip, mempool, bloc) : pas de 2e vérification Ed25519
+SIG_CACHE_SIZE = int(os.getenv("FRE_SIG_CACHE_SIZE", "20000"))
 
 # ===========================
 # MODE DEV (validation souple)
@@ -121,7 +165,75 @@ SNAPSHOT_DIR = os.path.join(DATA_DIR, "snapshots")
 # ===========================
 PEERS_FILE = os.path.join(DATA_DIR, "peers.json")
 P2P_PRIVKEY_ENV = os.getenv("FRE_P2P_PRIVKEY", os.getenv("FRE_VALIDATOR_PRIVKEY", ""))
+# Pairs abusifs (peer_guard.py) : débit limité par pair et par type de message (seaux
+# à jetons : (jetons/s, rafale)), score de mauvaise conduite qui décroît avec le temps,
+# ban temporaire persisté. Un pair banni (IP ou clé P2P) est déconnecté et refusé
+# avant tout décodage de ses messages. Les adresses loopback (plusieurs nodes sur une
+# même machine) ne sont ni limitées ni bannies par IP, seulement par clé P2P.
+BANS_FILE = os.path.join(DATA_DIR, "bans.json")
 P2P_BAN_THRESHOLD = 5
+P2P_BAN_DURATION_SEC = int(os.getenv("FRE_P2P_BAN_DURATION", "3600"))
+P2P_BAN_HALF_LIFE_SEC = 600     # le score d'un pair est divisé par 2 toutes les 10 min
+P2P_RATE_PENALTY = 0.1          # score par message refusé pour débit excessif
+P2P_PEER_RATE = (float(os.getenv("FRE_P2P_PEER_RATE", "500")), 2000)
+P2P_TYPE_RATES = {
+    "HELLO": (0.1, 5),
+    "INV": (50, 200),
+    "GETDATA": (50, 200),
+    "TX": (300, 2000),
+    "BLOCK": (10, 50),
+    "CMPCTBLOCK": (10, 50),
+    "GETBLOCKTXN": (5, 20),
+    "BLOCKTXN": (10, 50),
+    # synchronisation : une requête par aller-retour (lot suivant demandé dès la réponse),
+    # le débit honnête est borné par la vérification des lots, pas par ces limites
+    "REQUEST_HEADERS": (100, 400),
+    "HEADERS": (100, 400),
+    "REQUEST_BLOCKS": (25, 100),
+    "BLOCKS": (25, 100),
+}
+P2P_RATE_TRACKED = 10000        # seaux (pair, type) et scores de pairs conservés (LRU)
+# Connexions persistantes : file d'envoi bornée par pair (les plus anciens messages
+# sont abandonnés si le pair ne suit pas), ping WS, reconnexion avec backoff exponentiel
+P2P_PEER_QUEUE_SIZE = int(os.getenv("FRE_P2P_PEER_QUEUE_SIZE", "256"))
+P2P_PING_INTERVAL = 20
+P2P_PING_TIMEOUT = 20
+P2P_RECONNECT_MIN_SEC = 1
+P2P_RECONNECT_MAX_SEC = 60
+# Envoi vers un pair : au-delà du timeout la connexion est jugée lente, fermée puis
+# reconnectée (les autres pairs ne l'attendent pas) ; nombre d'envois simultanés plafonné
+P2P_SEND_TIMEOUT_SEC = float(os.getenv("FRE_P2P_SEND_TIMEOUT", "5"))
+P2P_MAX_CONCURRENT_SENDS = int(os.getenv("FRE_P2P_MAX_CONCURRENT_SENDS", "32"))
+# Gossip par inventaire : tx et blocs annoncés par hash (INV), contenu envoyé sur
+# demande (GETDATA). Cache des éléments déjà vus (tx_id, hash de bloc) pour ne
+# traiter / redemander chaque élément qu'une fois ; annonces de tx regroupées.
+P2P_SEEN_CACHE_SIZE = int(os.getenv("FRE_P2P_SEEN_CACHE_SIZE", "50000"))
+P2P_INV_INTERVAL_SEC = 0.2
+P2P_INV_MAX_ITEMS = 1000
+P2P_GETDATA_TIMEOUT_SEC = 10    # élément demandé mais pas reçu : redemandé au prochain INV
+# Blocs compacts : en-tête + préfixes des tx_id (P2P_SHORT_ID_LEN caractères hex), le
+# destinataire reconstruit le bloc depuis sa mempool et ne demande que les tx manquantes
+P2P_SHORT_ID_LEN = 12
+P2P_COMPACT_PENDING = 64        # blocs compacts en attente de leurs tx manquantes
+# Synchronisation par plages (sync.py) : morceaux de SYNC_CHUNK_SIZE blocs demandés en
+# parallèle à plusieurs pairs, au plus SYNC_WINDOW_CHUNKS morceaux au-delà du tip local
+SYNC_CHUNK_SIZE = int(os.getenv("FRE_SYNC_CHUNK_SIZE", "64"))
+SYNC_WINDOW_CHUNKS = int(os.getenv("FRE_SYNC_WINDOW_CHUNKS", "16"))
+SYNC_MAX_INFLIGHT_PER_PEER = 4
+SYNC_REQUEST_TIMEOUT_SEC = 15   # morceau non reçu : redemandé à un autre pair
+SYNC_MAX_PEER_FAILURES = 3      # au-delà, pair ignoré jusqu'à ses prochains HEADERS
+SYNC_HEADERS_MAX = 200          # headers par réponse HEADERS
+SYNC_MAX_BLOCKS_PER_REQUEST = 500   # plafond servi par REQUEST_BLOCKS
+SYNC_POLL_SEC = 30              # REQUEST_HEADERS périodique (découverte des tips)
+# Format des messages : trame binaire signée sur sha256(payload), négociée dans HELLO.
+# json : payload JSON compact (le plus rapide en CPU) | cbor1 : CBOR déterministe (plus
+# compact, encodé en Python pur) | legacy : JSON texte uniquement. Les pairs qui
+# n'annoncent pas de codec reçoivent toujours le JSON texte.
+P2P_CODEC = os.getenv("FRE_P2P_CODEC", "json").lower()
+# Messages P2P en attente de traitement (au-delà, la lecture des connexions attend)
+P2P_INBOX_SIZE = int(os.getenv("FRE_P2P_INBOX_SIZE", "1024"))
+# Threads pour les traitements bloquants (écritures ledger/state, vérifications) hors boucle asyncio
+NODE_IO_WORKERS = int(os.getenv("FRE_NODE_IO_WORKERS", "4"))
 
 # ===========================
 # ADMIN API (broadcast update)
@@ -2,8 +2,9 @@ import time
 from datetime import datetime
 from .block import Block
 from .config import MAX_TX_PER_BLOCK, NODE_NAME, BLOCK_REWARD, VALIDATOR_PRIVKEY_ENV, ANCHOR_FREQUENCY_BLOCKS, SNAPSHOT_INTERVAL, VALIDATOR
-from .utils import load_signing_key, sign_message, verify_signature_raw
-from .validator_set import load_validators, select_producer, get_pubkey
+from .utils import load_signing_key, sign_message
+from .validator_set import load_validators, select_producer
+from .verification import check_block, verify_chain_segment
 from .ton_anchor import anchor_client
 from .snapshot_manager import save_snapshot
 from .state import get_global_state
@@ -44,8 +45,49 @@ class Consensus:
         prev_block = self.ledger.get_latest_block()
         prev_hash = prev_block["hash"] if prev_block else "0" * 64
 
-        txs = self.mempool.pop_transactions(MAX_TX_PER_BLOCK)
+        height = prev_block["index"] + 1 if prev_block else 0
+        producer_name = VALIDATOR.get("name", NODE_NAME)
+        expected_producer = select_producer(height, self.validators, weighted=True)
+        if expected_producer != producer_name:
+            return None  # ce node n'est pas producteur pour ce slot
+
+        # suites de nonces exécutables uniquement (ordre par sender respecté)
+        txs = self.mempool.pop_transactions(MAX_TX_PER_BLOCK, nonce_of=self.state.get_nonce)
+
+        # toutes les mutations du bloc sont persistées en une fois (commit)
+        self.state.begin()
+        try:
+            new_block = self._build_block(height, prev_hash, producer_name, txs)
+            added = self.ledger.add_block(new_block)
+        except Exception:
+            self.state.abort()
+            raise
+        if not added:
+            self.state.abort()
+            return None
+        self.state.commit()
+
+        # Ancrage TON (tous les N blocs)
+        if new_block.index % ANCHOR_FREQUENCY_BLOCKS == 0:
+            anchor_client.anchor_block(new_block.to_dict())
+
+        # Snapshot périodique
+        if new_block.index % SNAPSHOT_INTERVAL == 0:
+            save_snapshot(
+                {
+                    "balances": self.state.balances,
+                    "nonces": self.state.nonces,
+                    "state_root": new_block.state_root,
+                },
+                new_block.index,
+                producer_pub=self.signing_key.verify_key.encode().hex() if self.signing_key else "",
+                privkey_b64=VALIDATOR_PRIVKEY_ENV,
+            )
+
+        return new_block.to_dict()
 
+    def _build_block(self, height, prev_hash, producer_name, txs) -> Block:
+        """Applique les transactions au state (bloc ouvert) et construit le bloc signé."""
         applied_txs = []
         total_fees = 0
 
@@ -57,24 +99,16 @@ class Consensus:
             # les transactions invalides sont ignorées, non rejouées
 
         reward_total = total_fees + (BLOCK_REWARD if BLOCK_REWARD else 0)
-        producer_name = VALIDATOR.get("name", NODE_NAME)
         if reward_total > 0:
             self.state.credit(producer_name, reward_total)
 
-        state_root = self.state.compute_state_root()
-
-        height = prev_block["index"] + 1 if prev_block else 0
-        expected_producer = select_producer(height, self.validators, weighted=True)
-        if expected_producer != producer_name:
-            return None  # ce node n'est pas producteur pour ce slot
-
         new_block = Block(
             index=height,
             timestamp=int(time.time()),
             txs=applied_txs,
             prev_hash=prev_hash,
             validator=producer_name,
-            state_root=state_root,
+            state_root=self.state.compute_state_root(height),
             total_fees=total_fees,
             block_reward=(BLOCK_REWARD if BLOCK_REWARD else 0),
         )
@@ -82,28 +116,7 @@ class Consensus:
         # Signature du bloc par le producteur
         if self.signing_key:
             new_block.block_signature = sign_message(self.signing_key, new_block.hash.encode())
-
-        # Sauvegarde dans ledger
-        added = self.ledger.add_block(new_block)
-
-        # Ancrage TON (tous les N blocs)
-        if added and (new_block.index % ANCHOR_FREQUENCY_BLOCKS == 0):
-            anchor_client.anchor_block(new_block.to_dict())
-
-        # Snapshot périodique
-        if added and (new_block.index % SNAPSHOT_INTERVAL == 0):
-            save_snapshot(
-                {
-                    "balances": self.state.balances,
-                    "nonces": self.state.nonces,
-                    "state_root": state_root,
-                },
-                new_block.index,
-                producer_pub=self.signing_key.verify_key.encode().hex() if self.signing_key else "",
-                privkey_b64=VALIDATOR_PRIVKEY_ENV,
-            )
-
-        return new_block.to_dict()
+        return new_block
 
     # ======================================
     # VALIDATION D’UN BLOC EXISTANT
@@ -114,38 +127,28 @@ class Consensus:
     def validate_block(block: dict, prev_block: dict) -> bool:
         """
         V?rifie :
-        - index correct
         - prev_hash correct
-        - hash correct (inclut merkle_root)
+        - hash correct (inclut merkle_root), fees, producteur et signature
         """
         if prev_block and block["prev_hash"] != prev_block["hash"]:
             return False
-
-        block_obj = Block(
-            index=block["index"],
-            timestamp=block["timestamp"],
-            txs=block["txs"],
-            prev_hash=block["prev_hash"],
-            validator=block["validator"],
-            state_root=block["state_root"],
-            merkle_root=block.get("merkle_root")
-        )
-
-        if block_obj.hash != block["hash"]:
+        reason = check_block(block, load_validators())
+        if reason:
+            print(f"[CONSENSUS] Bloc #{block.get('index')} : {reason}")
             return False
-
-        # Producer selection + signature (skip genesis)
-        if block_obj.index > 0:
-            validators = load_validators()
-            expected = select_producer(block_obj.index, validators)
-            if block_obj.validator != expected:
-                return False
-
-            pubkey = get_pubkey(validators, block_obj.validator)
-            sig = block.get("block_signature")
-            if not pubkey or not sig:
-                return False
-            if not verify_signature_raw(pubkey, block_obj.hash.encode(), sig):
-                return False
-
         return True
+
+    @staticmethod
+    def validate_blocks(blocks: list, prev_block: dict) -> int:
+        """
+        Validation d'un lot de blocs consécutifs (ex: message BLOCKS) :
+        chaînage dans l'ordre, signatures/merkle/fees en parallèle.
+        Retourne le nombre de blocs valides en tête du lot.
+        """
+        prev_hash = prev_block["hash"] if prev_block else None
+        bad = verify_chain_segment(blocks, prev_hash, load_validators())
+        if not bad:
+            return len(blocks)
+        pos, reason = bad
+        print(f"[CONSENSUS] Bloc #{blocks[pos].get('index')} : {reason}")
+        return pos
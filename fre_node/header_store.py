@@ -0,0 +1,116 @@
+import json
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Optional
+
+from .config import HEADERS_FILE
+
+
+class HeaderStore:
+    """
+    Persistent header chain: every known header (local blocks and remote
+    branches) with its cumulative stake weight, plus the best branch
+    (heaviest known tip) as a height -> hash table.
+    Bodies are only downloaded for the best branch; switching branches is a
+    walk over stored headers, not a re-download.
+    """
+
+    def __init__(self, path: str = HEADERS_FILE):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS headers ("
+                "hash TEXT PRIMARY KEY, height INTEGER NOT NULL, prev_hash TEXT NOT NULL, "
+                "weight INTEGER NOT NULL, header TEXT NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS headers_height ON headers(height)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS best (height INTEGER PRIMARY KEY, hash TEXT NOT NULL)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+
+    @staticmethod
+    def _row(row) -> Optional[dict]:
+        if not row:
+            return None
+        header = json.loads(row[0])
+        header["weight"] = row[1]
+        return header
+
+    def get(self, block_hash: str) -> Optional[dict]:
+        """Header (with its cumulative "weight") or None."""
+        with self._lock:
+            row = self._db.execute("SELECT header, weight FROM headers WHERE hash = ?", (block_hash,)).fetchone()
+        return self._row(row)
+
+    def add(self, header: dict, weight: int):
+        header = {k: v for k, v in header.items() if k != "weight"}
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR IGNORE INTO headers (hash, height, prev_hash, weight, header) VALUES (?, ?, ?, ?, ?)",
+                (header["block_hash"], header["height"], header["prev_hash"], weight, json.dumps(header, sort_keys=True)),
+            )
+
+    # =====================================
+    # BEST BRANCH
+    # =====================================
+
+    def tip(self) -> Optional[dict]:
+        """Tip of the best branch (heaviest known), with its weight."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT h.header, h.weight FROM best b JOIN headers h ON h.hash = b.hash "
+                "ORDER BY b.height DESC LIMIT 1"
+            ).fetchone()
+        return self._row(row)
+
+    def best_hash(self, height: int) -> Optional[str]:
+        with self._lock:
+            row = self._db.execute("SELECT hash FROM best WHERE height = ?", (height,)).fetchone()
+        return row[0] if row else None
+
+    def set_best(self, tip_hash: str) -> int:
+        """
+        Make the branch ending at tip_hash the best one: walk back to the first
+        header already on the best branch and rewrite only what is above it.
+        Returns the height of that common ancestor (-1 if none).
+        """
+        with self._lock, self._db:
+            branch = []
+            fork = -1
+            block_hash = tip_hash
+            while True:
+                row = self._db.execute("SELECT height, prev_hash FROM headers WHERE hash = ?", (block_hash,)).fetchone()
+                if not row:
+                    break  # avant le genesis
+                height, prev_hash = row
+                on_best = self._db.execute("SELECT 1 FROM best WHERE height = ? AND hash = ?", (height, block_hash)).fetchone()
+                if on_best:
+                    fork = height
+                    break
+                branch.append((height, block_hash))
+                block_hash = prev_hash
+            self._db.execute("DELETE FROM best WHERE height > ?", (fork,))
+            self._db.executemany("INSERT OR REPLACE INTO best (height, hash) VALUES (?, ?)", branch)
+        return fork
+
+    # =====================================
+    # LOCAL CHAIN
+    # =====================================
+
+    def indexed_height(self) -> int:
+        """Last local block whose header was recorded (catch-up on startup)."""
+        with self._lock:
+            row = self._db.execute("SELECT value FROM meta WHERE key = 'height'").fetchone()
+        return row[0] if row else -1
+
+    def set_indexed_height(self, height: int):
+        with self._lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('height', ?)", (height,))
+
+    def close(self):
+        with self._lock:
+            self._db.close()
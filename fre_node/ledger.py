@@ -1,49 +1,61 @@
 ﻿import json
 import os
-from .config import CHAIN_FILE, BLOCK_REWARD
+import time
+from pathlib import Path
+from .config import (
+    CHAIN_FILE,
+    BLOCK_CACHE_SIZE,
+    CHECKPOINT_FILE,
+    CHECKPOINT_INTERVAL,
+    FULL_VERIFY,
+    VERIFY_BATCH_SIZE,
+)
 from .block import Block
-from .validator_set import load_validators, select_producer, get_pubkey
-from .utils import verify_signature_raw, compute_tx_id
+from .block_store import BlockStore
+from .tx_index import TxIndex
+from .header_store import HeaderStore
+from .validator_set import load_validators, get_pubkey, stake_of
+from .verification import check_block, verify_chain_segment
+from .utils import LRUCache
 
 
 class Ledger:
     """
-    JSON ledger with basic validation and atomic writes.
+    Ledger backed by an append-only segmented BlockStore, with basic validation.
+    Blocks are read on demand through the store index; only an LRU cache of
+    decoded blocks (BLOCK_CACHE_SIZE) is kept in memory.
+    A persisted checkpoint lets startup skip full validation of old blocks.
+    Included transactions are indexed by tx_id (TxIndex) for O(1) lookups.
+    Block headers are recorded in the HeaderStore with their cumulative stake
+    weight, next to the remote branches used for fork choice.
     """
 
-    def __init__(self):
-        if not os.path.exists(CHAIN_FILE):
-            print("[LEDGER] Creating chain.json")
-            self._write_chain([])
-        self.chain = self._read_chain()
+    def __init__(self, full_verify: bool = FULL_VERIFY):
+        self.store = BlockStore()
+        self.cache = LRUCache(BLOCK_CACHE_SIZE)
+        if self.store.count() == 0 and os.path.exists(CHAIN_FILE):
+            self._import_chain_file()
+        self._latest = self.store.read(self.store.count() - 1)
         self.validators = load_validators()
-        self._validate_chain_on_load()
+        self._validate_chain_on_load(full_verify)
+        self.tx_index = TxIndex()
+        self._sync_tx_index()
+        self.headers = HeaderStore()
+        self._sync_headers()
 
     # =====================================
     # READ / WRITE
     # =====================================
 
-    def _read_chain(self):
+    def _import_chain_file(self):
+        """One-shot import of a legacy chain.json into the block store."""
         with open(CHAIN_FILE, "r") as f:
             raw_chain = json.load(f)
-        return [self._normalize_block(blk) for blk in raw_chain]
-
-    def _write_chain(self, chain):
-        """Atomic write with backup chain.json.bak"""
-        tmp_path = CHAIN_FILE + ".tmp"
-        bak_path = CHAIN_FILE + ".bak"
-
-        if os.path.exists(CHAIN_FILE):
-            try:
-                if os.path.exists(bak_path):
-                    os.remove(bak_path)
-                os.replace(CHAIN_FILE, bak_path)
-            except Exception:
-                pass
-
-        with open(tmp_path, "w") as f:
-            json.dump(chain, f, indent=4)
-        os.replace(tmp_path, CHAIN_FILE)
+        for blk in raw_chain:
+            self.store.append(self._normalize_block(blk), sync=False)
+        self.store.sync(force=True)
+        os.replace(CHAIN_FILE, CHAIN_FILE + ".imported")
+        print(f"[LEDGER] Imported {len(raw_chain)} blocks from chain.json")
 
     def _normalize_block(self, blk: dict) -> dict:
         txs = blk.get("txs", blk.get("transactions", []))
@@ -81,52 +93,188 @@ class Ledger:
     # =====================================
 
     def get_latest_block(self):
-        if len(self.chain) == 0:
-            return None
-        return self.chain[-1]
+        return self._latest
 
     def get_block(self, index: int):
-        if 0 <= index < len(self.chain):
-            return self.chain[index]
-        return None
+        if not 0 <= index < self.store.count():
+            return None
+        blk = self.cache.get(index)
+        if blk is None:
+            blk = self.store.read(index)
+            self.cache.put(index, blk)
+        return blk
+
+    def get_blocks(self, start: int, end: int):
+        """Blocks in [start, end), clamped to the current chain."""
+        start = max(start, 0)
+        end = min(end, self.store.count())
+        return [self.get_block(h) for h in range(start, end)]
 
     def get_chain(self):
-        return self.chain
+        """Full chain as a list (loads every block: reserved for the legacy /blockchain route)."""
+        return list(self.store.iter_blocks())
 
     def count_blocks(self):
-        return len(self.chain)
+        return self.store.count()
+
+    def find_tx(self, tx_id: str):
+        """(block, position) d'une transaction incluse, ou None."""
+        found = self.tx_index.get(tx_id)
+        if not found:
+            return None
+        height, position = found
+        blk = self.get_block(height)
+        if not blk or position >= len(blk.get("txs", [])):
+            return None
+        return blk, position
+
+    def _sync_tx_index(self):
+        """Rattrape l'index des tx sur le store (crash entre les deux écritures, premier démarrage)."""
+        tip = self.store.count() - 1
+        indexed = self.tx_index.indexed_height()
+        if indexed > tip:
+            self.tx_index.truncate(tip)
+            indexed = tip
+        if indexed < tip:
+            print(f"[LEDGER] Indexing transactions of blocks #{indexed + 1}..#{tip}")
+            for blk in self.store.iter_blocks(indexed + 1):
+                self.tx_index.add_block(blk)
+
+    def block_header(self, blk: dict) -> dict:
+        """
+        Header P2P d'un bloc : le producteur est désigné par sa pubkey, et tous les
+        champs couverts par Block.compute_hash sont présents (hash recalculable).
+        """
+        pubkey = get_pubkey(self.validators, blk.get("validator", ""))
+        return {
+            "height": blk["index"],
+            "prev_hash": blk["prev_hash"],
+            "block_hash": blk["hash"],
+            "merkle_root": blk.get("merkle_root", ""),
+            "state_root": blk.get("state_root", ""),
+            "validator": blk.get("validator", ""),
+            "total_fees": blk.get("total_fees", 0),
+            "block_reward": blk.get("block_reward", 0),
+            "producer": pubkey or blk.get("validator", ""),
+            "timestamp": blk.get("timestamp", ""),
+            "signature": blk.get("block_signature", ""),
+        }
+
+    def _record_header(self, blk: dict):
+        """Header d'un bloc local + poids cumulé ; devient la meilleure branche s'il est le plus lourd."""
+        parent = self.headers.get(blk["prev_hash"]) if blk["index"] > 0 else None
+        # bloc déjà validé : un producteur hors liste (ex: genesis) compte pour 1
+        weight = (parent["weight"] if parent else 0) + (stake_of(self.validators, blk.get("validator", "")) or 1)
+        self.headers.add(self.block_header(blk), weight)
+        tip = self.headers.tip()
+        if tip is None or weight > tip["weight"]:
+            self.headers.set_best(blk["hash"])
+        self.headers.set_indexed_height(blk["index"])
+
+    def _sync_headers(self):
+        """Rattrape le HeaderStore sur les blocs locaux (premier démarrage, crash)."""
+        tip = self.store.count() - 1
+        indexed = self.headers.indexed_height()
+        if indexed > tip:
+            self.headers.set_indexed_height(tip)
+            indexed = tip
+        if indexed < tip:
+            print(f"[LEDGER] Recording headers of blocks #{indexed + 1}..#{tip}")
+            for blk in self.store.iter_blocks(indexed + 1):
+                self._record_header(blk)
 
     def truncate(self, height: int):
         """
-        Coupe la chaine au height indiqué (conserve), rewrite chain.json
+        Coupe la chaine au height indiqué (conserve), tronque les segments
         """
-        if height < 0:
-            self.chain = []
-        else:
-            self.chain = self.chain[: height + 1]
-        self._write_chain(self.chain)
+        self.store.truncate(height)
+        self.tx_index.truncate(height)
+        self.headers.set_indexed_height(height)
+        self.cache.clear()
+        self._latest = self.store.read(self.store.count() - 1)
+        checkpoint = self._load_checkpoint()
+        if checkpoint and checkpoint["height"] > height:
+            self._save_checkpoint()
 
     # =====================================
     # ADD BLOCK
     # =====================================
 
-    def add_block(self, block):
+    def add_block(self, block, verified: bool = False):
+        """
+        Append a block after validation. verified=True skips the stateless
+        checks (signature, merkle, fees) already done by the caller.
+        """
         blk_dict = block.to_dict()
 
-        if not self._validate_new_block(blk_dict):
+        if not self._validate_new_block(blk_dict, verified):
             print("[LEDGER] Block rejected (validation)")
             return False
 
-        self.chain.append(blk_dict)
-        self._write_chain(self.chain)
+        self.store.append(blk_dict)
+        self.tx_index.add_block(blk_dict)
+        self._record_header(blk_dict)
+        self.cache.put(blk_dict["index"], blk_dict)
+        self._latest = blk_dict
+        if blk_dict["index"] % CHECKPOINT_INTERVAL == 0:
+            self._save_checkpoint()
         print(f"[LEDGER] Block #{blk_dict['index']} added.")
         return True
 
+    # =====================================
+    # CHECKPOINT
+    # =====================================
+
+    def _load_checkpoint(self):
+        path = Path(CHECKPOINT_FILE)
+        if not path.exists():
+            return None
+        try:
+            data = json.loads(path.read_text())
+            return {"height": int(data["height"]), "hash": str(data["hash"])}
+        except Exception:
+            return None
+
+    def _save_checkpoint(self):
+        """Record the current tip as verified (only called once blocks passed validation)."""
+        latest = self.get_latest_block()
+        path = Path(CHECKPOINT_FILE)
+        if not latest:
+            path.unlink(missing_ok=True)
+            return
+        data = {"height": latest["index"], "hash": latest["hash"], "updated_at": int(time.time())}
+        tmp = Path(str(path) + ".tmp")
+        tmp.write_text(json.dumps(data, indent=2))
+        tmp.replace(path)
+
+    def _trusted_checkpoint(self):
+        """Checkpoint usable for this store, or None (missing, beyond tip, or other hash)."""
+        checkpoint = self._load_checkpoint()
+        if not checkpoint:
+            return None
+        height = checkpoint["height"]
+        if not 0 <= height < self.store.count():
+            print("[LEDGER] Checkpoint beyond chain tip, ignored")
+            return None
+        blk = self.get_block(height)
+        if blk.get("hash") != checkpoint["hash"] or self.store.entry(height)[3] != checkpoint["hash"]:
+            print(f"[LEDGER] Checkpoint hash mismatch at #{height}, ignored")
+            return None
+        return checkpoint
+
+    def _check_links(self, end: int):
+        """Cheap hash-link check of blocks [0, end) using the store index only."""
+        prev_hash = None
+        for i, blk_hash, blk_prev in self.store.iter_entries(0, end):
+            if i > 0 and blk_prev != prev_hash:
+                raise ValueError(f"Block #{i} invalid chain link")
+            prev_hash = blk_hash
+
     # =====================================
     # VALIDATION
     # =====================================
 
-    def _validate_new_block(self, blk: dict) -> bool:
+    def _validate_new_block(self, blk: dict, verified: bool = False) -> bool:
         latest = self.get_latest_block()
 
         if latest:
@@ -141,102 +289,34 @@ class Ledger:
                 print("[LEDGER] Invalid genesis index")
                 return False
 
-        try:
-            block_obj = Block(
-                index=blk["index"],
-                timestamp=blk["timestamp"],
-                txs=blk["txs"],
-                prev_hash=blk["prev_hash"],
-                validator=blk["validator"],
-                state_root=blk.get("state_root", ""),
-                merkle_root=blk.get("merkle_root"),
-                block_signature=blk.get("block_signature"),
-                total_fees=blk.get("total_fees", 0),
-                block_reward=blk.get("block_reward", 0),
-            )
-        except Exception:
-            print("[LEDGER] Malformed block")
-            return False
-
-        # recalcul fees to compare
-        fees_sum = sum(tx.get("fee", 0) for tx in blk.get("txs", []))
-        if blk.get("total_fees", 0) != fees_sum:
-            print("[LEDGER] Invalid total_fees")
-            return False
-        if blk.get("block_reward", 0) != (BLOCK_REWARD if BLOCK_REWARD else 0):
-            print("[LEDGER] Invalid block_reward")
-            return False
-
-        # deduplicate TX in block
-        tx_ids = [compute_tx_id(tx) for tx in blk.get("txs", [])]
-        if len(tx_ids) != len(set(tx_ids)):
-            print("[LEDGER] Duplicate transactions in block")
-            return False
-
-        if blk.get("merkle_root") and blk.get("merkle_root") != block_obj.merkle_root:
-            print("[LEDGER] Invalid merkle_root")
-            return False
+        # bloc déjà passé par check_block (ex: lot BLOCKS vérifié en parallèle)
+        if verified:
+            return True
 
-        if blk.get("hash") != block_obj.hash:
-            print("[LEDGER] Invalid hash")
+        reason = check_block(blk, self.validators)
+        if reason:
+            print(f"[LEDGER] {reason.capitalize()}")
             return False
-
-        # producer check + signature (skip genesis)
-        if blk.get("index", 0) > 0:
-            expected_producer = select_producer(blk["index"], self.validators, weighted=True)
-            if blk.get("validator") != expected_producer:
-                print("[LEDGER] Invalid producer")
-                return False
-
-            pubkey = get_pubkey(self.validators, blk.get("validator"))
-            if not pubkey or not blk.get("block_signature"):
-                print("[LEDGER] Missing pubkey or signature")
-                return False
-            if not verify_signature_raw(pubkey, block_obj.hash.encode(), blk["block_signature"]):
-                print("[LEDGER] Invalid block signature")
-                return False
-
         return True
 
-    def _validate_chain_on_load(self):
-        for i, blk in enumerate(self.chain):
-            block_obj = Block(
-                index=blk["index"],
-                timestamp=blk["timestamp"],
-                txs=blk["txs"],
-                prev_hash=blk["prev_hash"],
-                validator=blk["validator"],
-                state_root=blk.get("state_root", ""),
-                merkle_root=blk.get("merkle_root"),
-                block_signature=blk.get("block_signature"),
-                total_fees=blk.get("total_fees", 0),
-                block_reward=blk.get("block_reward", 0),
-            )
-            tx_ids = [compute_tx_id(tx) for tx in blk.get("txs", [])]
-            if len(tx_ids) != len(set(tx_ids)):
-                raise ValueError(f"Block #{i} contains duplicate tx")
-            fees_sum = sum(tx.get("fee", 0) for tx in blk.get("txs", []))
-            if blk.get("total_fees", 0) != fees_sum:
-                raise ValueError(f"Block #{i} invalid total_fees")
-            if blk.get("block_reward", 0) != (BLOCK_REWARD if BLOCK_REWARD else 0):
-                raise ValueError(f"Block #{i} invalid block_reward")
-
-            if blk.get("merkle_root") and blk.get("merkle_root") != block_obj.merkle_root:
-                raise ValueError(f"Block #{i} invalid merkle_root")
-
-            if blk.get("hash") != block_obj.hash:
-                raise ValueError(f"Block #{i} invalid hash")
-
-            if i > 0 and blk.get("prev_hash") != self.chain[i - 1]["hash"]:
-                raise ValueError(f"Block #{i} invalid chain link")
-
-            if blk.get("index", 0) > 0:
-                expected_producer = select_producer(blk["index"], self.validators, weighted=True)
-                if blk.get("validator") != expected_producer:
-                    raise ValueError(f"Block #{i} invalid producer")
-
-                pubkey = get_pubkey(self.validators, blk.get("validator"))
-                if not pubkey or not blk.get("block_signature"):
-                    raise ValueError(f"Block #{i} missing pubkey or signature")
-                if not verify_signature_raw(pubkey, block_obj.hash.encode(), blk["block_signature"]):
-                    raise ValueError(f"Block #{i} invalid block signature")
+    def _validate_chain_on_load(self, full_verify: bool = False):
+        start = 0
+        prev_hash = None
+        checkpoint = None if full_verify else self._trusted_checkpoint()
+        if checkpoint:
+            self._check_links(checkpoint["height"] + 1)
+            start = checkpoint["height"] + 1
+            prev_hash = checkpoint["hash"]
+
+        # liens vérifiés dans l'ordre, signatures/merkle/fees en parallèle par lots
+        count = self.store.count()
+        for batch_start in range(start, count, VERIFY_BATCH_SIZE):
+            batch = list(self.store.iter_blocks(batch_start, batch_start + VERIFY_BATCH_SIZE))
+            bad = verify_chain_segment(batch, prev_hash, self.validators)
+            if bad:
+                pos, reason = bad
+                raise ValueError(f"Block #{batch_start + pos} {reason}")
+            prev_hash = batch[-1].get("hash")
+
+        if count > start:
+            self._save_checkpoint()
@@ -1,64 +1,323 @@
+import heapq
 import json
 import os
 import time
 from pathlib import Path
-from typing import List, Dict
+from typing import Callable, Dict, List, Optional
 
-from .config import MEMPOOL_FILE, MEMPOOL_TTL_SEC, MEMPOOL_MAX_SIZE
+from .config import (
+    MEMPOOL_FILE,
+    MEMPOOL_TTL_SEC,
+    MEMPOOL_EXPIRY_BUCKET_SEC,
+    MEMPOOL_MAX_SIZE,
+    MEMPOOL_MAX_PER_SENDER,
+    MEMPOOL_RBF_BUMP_PCT,
+    MEMPOOL_JOURNAL_FILE,
+    MEMPOOL_JOURNAL_COMPACT_OPS,
+    P2P_SHORT_ID_LEN,
+)
 from .utils import compute_tx_id
 
 
 class Mempool:
     """
     Persistent mempool with fee priority, dedup, TTL, and disk storage.
-    Stored as a JSON list of entries: {id, tx, received_at}.
+    Stored as a JSON list of entries: {id, tx, received_at} (mempool.json),
+    plus an append-only journal of add/del operations since that snapshot.
+    Persisting a change costs one journal line, whatever the pool size; the
+    journal is folded back into mempool.json once it grows large.
+
+    Transactions are queued per sender by nonce; a heap holds the head
+    (lowest pending nonce) of each sender, ordered by fee desc then age.
+    Selection pops the best head and promotes the sender's next nonce, so
+    blocks only ever receive executable nonce sequences.
+    Heap entries are invalidated lazily (checked against the current head).
+    Expiry uses time buckets (MEMPOOL_EXPIRY_BUCKET_SEC) so a purge only
+    touches expired entries; count and fee stats are kept incrementally.
+    Under load the pool keeps the best-paying transactions: replace-by-fee
+    for the same (from, nonce), a per-sender cap, and when full, eviction of
+    the cheapest entry (min-heap on fee) for a higher-fee arrival.
+    A short id (tx_id prefix) index serves compact block reconstruction.
     """
 
     def __init__(self):
-        self.transactions: List[Dict] = []  # entries: {id, tx, received_at}
-        self.tx_index = set()
+        self.tx_index: Dict[str, Dict] = {}            # id -> entry {id, tx, received_at}
+        self.senders: Dict[str, Dict[int, Dict]] = {}  # sender -> {nonce: entry}
+        self._heads: Dict[str, int] = {}               # sender -> nonce de tête
+        self._heap = []                                # (-fee, received_at, seq, id)
+        self._evict_heap = []                          # (fee, -received_at, seq, id) : moins chère d'abord
+        self._seq = 0
+        self._buckets: Dict[int, Dict[str, Dict]] = {}  # bucket de réception -> {id: entry}
+        self._bucket_keys = []                          # min-heap des buckets (lazy)
+        self._newest_bucket = None                      # bucket le plus récent, None = à recalculer
+        self._fee_counts: Dict[float, int] = {}         # fee -> nombre d'entrées
+        self._fee_sum = 0
+        self._fee_bounds = None                         # (min, max) en cache, None = à recalculer
+        self._short_ids: Dict[str, str] = {}            # préfixe P2P_SHORT_ID_LEN -> id (blocs compacts)
+        self._ops = []            # opérations pas encore écrites au journal
+        self._journal_ops = 0     # lignes dans le journal depuis la dernière compaction
+        self._journal = None
+        self._loading = True
         self._load()
+        self._loading = False
         self._purge_expired()
 
+    @property
+    def transactions(self) -> List[Dict]:
+        """Entries in insertion order (compat: ancienne liste)."""
+        return list(self.tx_index.values())
+
     # ============================
     # PERSISTENCE
     # ============================
 
     def _load(self):
-        if not os.path.exists(MEMPOOL_FILE):
+        if os.path.exists(MEMPOOL_FILE):
+            try:
+                data = json.loads(Path(MEMPOOL_FILE).read_text())
+                if isinstance(data, list):
+                    for e in data:
+                        if self._valid_entry(e):
+                            self._insert(e)
+            except Exception:
+                # corrupt file -> start empty
+                self._reset()
+        self._replay_journal()
+
+    @staticmethod
+    def _valid_entry(e) -> bool:
+        return isinstance(e, dict) and isinstance(e.get("tx"), dict) and bool(e.get("id"))
+
+    def _replay_journal(self):
+        """Rejoue les opérations postérieures au snapshot ; une ligne tronquée (crash) termine la lecture."""
+        if not os.path.exists(MEMPOOL_JOURNAL_FILE):
             return
-        try:
-            data = json.loads(Path(MEMPOOL_FILE).read_text())
-            if isinstance(data, list):
-                self.transactions = [e for e in data if isinstance(e, dict) and "tx" in e]
-                self.tx_index = {e.get("id") for e in self.transactions if e.get("id")}
-        except Exception:
-            # corrupt file -> start empty
-            self.transactions = []
-            self.tx_index = set()
+        with open(MEMPOOL_JOURNAL_FILE, "r") as f:
+            for line in f:
+                try:
+                    op = json.loads(line)
+                except ValueError:
+                    break
+                self._journal_ops += 1
+                if op.get("op") == "add" and self._valid_entry(op.get("entry")):
+                    self._insert(op["entry"])
+                elif op.get("op") == "del":
+                    entry = self.tx_index.get(op.get("id"))
+                    if entry:
+                        self._remove(entry)
+        # la suite du journal après une ligne invalide est perdue : on repart d'un snapshot propre
+        self._compact()
 
     def _save(self):
+        """Ajoute les opérations en attente au journal (une écriture), compacte si besoin."""
+        if self._ops:
+            if self._journal is None:
+                Path(MEMPOOL_JOURNAL_FILE).parent.mkdir(parents=True, exist_ok=True)
+                self._journal = open(MEMPOOL_JOURNAL_FILE, "a")
+            self._journal.write("".join(json.dumps(op, separators=(",", ":")) + "\n" for op in self._ops))
+            self._journal.flush()
+            self._journal_ops += len(self._ops)
+            self._ops = []
+        if self._journal_ops > max(MEMPOOL_JOURNAL_COMPACT_OPS, 2 * len(self.tx_index)):
+            self._compact()
+
+    def _compact(self):
+        """Réécrit mempool.json (tmp + replace) puis vide le journal."""
         Path(MEMPOOL_FILE).parent.mkdir(parents=True, exist_ok=True)
         tmp = Path(str(MEMPOOL_FILE) + '.tmp')
         Path(tmp).write_text(json.dumps(self.transactions, indent=2))
         os.replace(tmp, MEMPOOL_FILE)
+        if self._journal is not None:
+            self._journal.close()
+        # le snapshot est en place : un crash ici rejoue au pire des opérations idempotentes
+        self._journal = open(MEMPOOL_JOURNAL_FILE, "w")
+        self._journal_ops = 0
+        self._ops = []
+
+    def _reset(self):
+        self.tx_index = {}
+        self.senders = {}
+        self._heads = {}
+        self._heap = []
+        self._evict_heap = []
+        self._buckets = {}
+        self._bucket_keys = []
+        self._newest_bucket = None
+        self._fee_counts = {}
+        self._fee_sum = 0
+        self._fee_bounds = None
+        self._short_ids = {}
+
+    # ============================
+    # INDEXES (heap + files par sender)
+    # ============================
+
+    @staticmethod
+    def _nonce(entry: Dict) -> int:
+        nonce = entry["tx"].get("nonce", 0)
+        return nonce if isinstance(nonce, int) else 0
+
+    @staticmethod
+    def _fee(entry: Dict):
+        fee = entry["tx"].get("fee", 0)
+        return fee if isinstance(fee, (int, float)) else 0
+
+    @staticmethod
+    def _bucket(entry: Dict) -> int:
+        return int(entry.get("received_at", 0) // MEMPOOL_EXPIRY_BUCKET_SEC)
+
+    def _push_head(self, sender: str):
+        nonce = self._heads.get(sender)
+        if nonce is None:
+            return
+        entry = self.senders[sender][nonce]
+        self._seq += 1
+        heapq.heappush(self._heap, (-self._fee(entry), entry.get("received_at", 0), self._seq, entry["id"]))
+
+    def _track(self, entry: Dict):
+        """Bucket d'expiration + stats de fees + short id, O(log b)."""
+        # collision de préfixe : la première tx garde le short id (merkle vérifié par le node)
+        self._short_ids.setdefault(entry["id"][:P2P_SHORT_ID_LEN], entry["id"])
+        key = self._bucket(entry)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = {}
+            heapq.heappush(self._bucket_keys, key)
+            if self._newest_bucket is not None or len(self._buckets) == 1:
+                self._newest_bucket = max(self._newest_bucket if self._newest_bucket is not None else key, key)
+        bucket[entry["id"]] = entry
+        fee = self._fee(entry)
+        self._seq += 1
+        heapq.heappush(self._evict_heap, (fee, -entry.get("received_at", 0), self._seq, entry["id"]))
+        self._fee_counts[fee] = self._fee_counts.get(fee, 0) + 1
+        self._fee_sum += fee
+        if self._fee_bounds is not None:
+            self._fee_bounds = (min(self._fee_bounds[0], fee), max(self._fee_bounds[1], fee))
+        elif len(self._fee_counts) == 1:
+            self._fee_bounds = (fee, fee)
+
+    def _untrack(self, entry: Dict):
+        short_id = entry["id"][:P2P_SHORT_ID_LEN]
+        if self._short_ids.get(short_id) == entry["id"]:
+            del self._short_ids[short_id]
+        key = self._bucket(entry)
+        bucket = self._buckets.get(key)
+        if bucket is not None:
+            bucket.pop(entry["id"], None)
+            if not bucket:
+                del self._buckets[key]  # la clé reste dans le heap, ignorée au purge
+                if key == self._newest_bucket:
+                    self._newest_bucket = None
+        fee = self._fee(entry)
+        left = self._fee_counts.get(fee, 0) - 1
+        if left > 0:
+            self._fee_counts[fee] = left
+        else:
+            self._fee_counts.pop(fee, None)
+            if self._fee_bounds is not None and fee in self._fee_bounds:
+                self._fee_bounds = None  # borne disparue : recalcul paresseux dans stats()
+        self._fee_sum -= fee
+
+    def _is_head(self, entry: Dict) -> bool:
+        return self._heads.get(entry["tx"].get("from")) == self._nonce(entry)
+
+    def _insert(self, entry: Dict) -> bool:
+        """O(log n) : file du sender + heap si la tx devient la tête."""
+        sender = entry["tx"].get("from")
+        nonce = self._nonce(entry)
+        queue = self.senders.setdefault(sender, {})
+        if entry["id"] in self.tx_index or nonce in queue:
+            if not queue:
+                del self.senders[sender]
+            return False
+        queue[nonce] = entry
+        self.tx_index[entry["id"]] = entry
+        self._track(entry)
+        if not self._loading:
+            self._ops.append({"op": "add", "entry": entry})
+        head = self._heads.get(sender)
+        if head is None or nonce < head:
+            self._heads[sender] = nonce
+            self._push_head(sender)
+        return True
+
+    def _remove(self, entry: Dict):
+        """Retire une entrée ; si c'était la tête, le nonce suivant la remplace."""
+        sender = entry["tx"].get("from")
+        nonce = self._nonce(entry)
+        if self.tx_index.pop(entry["id"], None) is None:
+            return
+        self._untrack(entry)
+        if not self._loading:
+            self._ops.append({"op": "del", "id": entry["id"]})
+        queue = self.senders.get(sender)
+        if not queue or queue.get(nonce) is not entry:
+            return
+        del queue[nonce]
+        if not queue:
+            del self.senders[sender]
+            self._heads.pop(sender, None)
+            return
+        if self._heads.get(sender) == nonce:
+            self._heads[sender] = nonce + 1 if nonce + 1 in queue else min(queue)
+            self._push_head(sender)
+
+    def _compact_heap(self):
+        """Reconstruit les heaps quand les entrées périmées dominent."""
+        if len(self._heap) > 2 * len(self._heads) + 64:
+            self._heap = []
+            for sender in self._heads:
+                self._push_head(sender)
+        if len(self._evict_heap) > 2 * len(self.tx_index) + 64:
+            live = set(self.tx_index)
+            self._evict_heap = [item for item in self._evict_heap if item[3] in live]
+            heapq.heapify(self._evict_heap)
+
+    def _cheapest(self) -> Optional[Dict]:
+        """Entrée de plus petite fee (la plus récente à fee égale), lazy deletion."""
+        while self._evict_heap:
+            entry = self.tx_index.get(self._evict_heap[0][3])
+            if entry is not None:
+                return entry
+            heapq.heappop(self._evict_heap)
+        return None
+
+    def _evict(self, entry: Dict) -> int:
+        """Retire entry et les nonces suivants du même sender (devenus non exécutables)."""
+        sender = entry["tx"].get("from")
+        queue = self.senders.get(sender, {})
+        nonce = self._nonce(entry)
+        victims = [queue[n] for n in sorted(queue) if n >= nonce]
+        for victim in victims:
+            self._remove(victim)
+        return len(victims)
 
     # ============================
     # MAINTENANCE
     # ============================
 
     def _purge_expired(self):
+        """O(1) si rien n'a expiré : seuls les buckets entièrement périmés sont visités."""
         cutoff = time.time() - MEMPOOL_TTL_SEC
-        before = len(self.transactions)
-        self.transactions = [e for e in self.transactions if e.get('received_at', 0) >= cutoff]
-        self.tx_index = {e.get('id') for e in self.transactions if e.get('id')}
-        if len(self.transactions) != before:
+        expired = []
+        while self._bucket_keys:
+            key = self._bucket_keys[0]
+            if key in self._buckets and (key + 1) * MEMPOOL_EXPIRY_BUCKET_SEC > cutoff:
+                break
+            heapq.heappop(self._bucket_keys)
+            expired.extend(self._buckets.pop(key, {}).values())
+            if key == self._newest_bucket:
+                self._newest_bucket = None
+        for entry in expired:
+            self._remove(entry)
+        if expired:
+            self._compact_heap()
             self._save()
 
     def _sorted_entries(self):
         # sort by fee desc, then oldest first
         return sorted(
-            self.transactions,
+            self.tx_index.values(),
             key=lambda e: (
                 -int(e.get('tx', {}).get('fee', 0)),
                 e.get('received_at', 0)
@@ -75,16 +334,49 @@ class Mempool:
         tx_id = compute_tx_id(tx)
         if tx_id in self.tx_index:
             return False
-        if len(self.transactions) >= MEMPOOL_MAX_SIZE:
-            return False
 
         entry = {
             "id": tx_id,
             "tx": tx,
             "received_at": time.time(),
         }
-        self.transactions.append(entry)
-        self.tx_index.add(tx_id)
+        sender = tx.get("from")
+        nonce = self._nonce(entry)
+        fee = self._fee(entry)
+        queue = self.senders.get(sender, {})
+
+        # replace-by-fee : un seul tx par (sender, nonce), le mieux payé s'il paie assez plus
+        existing = queue.get(nonce)
+        if existing is not None:
+            old_fee = self._fee(existing)
+            if fee <= old_fee or fee * 100 < old_fee * (100 + MEMPOOL_RBF_BUMP_PCT):
+                print(f"[MEMPOOL] Remplacement refusé : fee {fee} < {old_fee} +{MEMPOOL_RBF_BUMP_PCT}%")
+                return False
+            self._remove(existing)
+            self._insert(entry)
+            self._save()
+            return True
+
+        if len(queue) >= MEMPOOL_MAX_PER_SENDER:
+            print(f"[MEMPOOL] Quota atteint pour {sender} ({MEMPOOL_MAX_PER_SENDER} tx)")
+            return False
+
+        # pool pleine : on évince les moins chères tant que l'arrivante paie plus
+        while len(self.tx_index) >= MEMPOOL_MAX_SIZE:
+            victim = self._cheapest()
+            if victim is None or self._fee(victim) >= fee:
+                print("[MEMPOOL] Pool pleine, fee trop basse")
+                self._save()
+                return False
+            if victim["tx"].get("from") == sender and self._nonce(victim) < nonce:
+                # évincer son propre prédécesseur rendrait la tx inexécutable
+                print("[MEMPOOL] Pool pleine, fee trop basse")
+                self._save()
+                return False
+            self._evict(victim)
+
+        self._insert(entry)
+        self._compact_heap()
         self._save()
         return True
 
@@ -92,50 +384,135 @@ class Mempool:
     # POP FOR BLOCKS
     # ============================
 
-    def pop_transactions(self, max_count: int):
+    def pop_transactions(self, max_count: int, nonce_of: Optional[Callable[[str], int]] = None):
+        """
+        Pop up to max_count transactions, best fee first, in nonce order per sender.
+        nonce_of(sender) gives the next executable nonce (state); entries below it
+        are stale and dropped, senders with a gap are skipped.
+        Without nonce_of, each sender's lowest pending nonce is taken as executable.
+        """
         self._purge_expired()
-        entries = self._sorted_entries()
-        selected = entries[:max_count]
-        selected_ids = {e["id"] for e in selected}
+        selected = []
+        skipped = []
+        expected = {}
+        changed = False
 
-        self.transactions = [e for e in self.transactions if e.get("id") not in selected_ids]
-        self.tx_index = {e.get("id") for e in self.transactions if e.get("id")}
-        if selected:
+        while self._heap and len(selected) < max_count:
+            item = heapq.heappop(self._heap)
+            entry = self.tx_index.get(item[3])
+            if entry is None or not self._is_head(entry):
+                continue  # entrée périmée (lazy deletion)
+
+            sender = entry["tx"].get("from")
+            nonce = self._nonce(entry)
+            if sender not in expected:
+                expected[sender] = nonce_of(sender) if nonce_of else nonce
+            if nonce < expected[sender]:
+                self._remove(entry)  # déjà exécutée : la tête suivante est poussée
+                changed = True
+                continue
+            if nonce > expected[sender]:
+                skipped.append(item)  # trou de nonce : non exécutable pour l'instant
+                continue
+
+            self._remove(entry)
+            selected.append(entry["tx"])
+            expected[sender] = nonce + 1
+            changed = True
+
+        for item in skipped:
+            heapq.heappush(self._heap, item)
+        self._compact_heap()
+        if changed:
             self._save()
 
-        return [e["tx"] for e in selected]
+        return selected
+
+    def remove_transactions(self, txs: List[dict], nonce_of: Optional[Callable[[str], int]] = None):
+        """
+        Drop transactions included in a block (received from a peer), and with
+        nonce_of, every pending entry of those senders whose nonce is now spent.
+        """
+        touched = set()
+        changed = False
+        for tx in txs:
+            entry = self.tx_index.get(compute_tx_id(tx))
+            if entry:
+                self._remove(entry)
+                changed = True
+            touched.add(tx.get("from"))
+
+        if nonce_of:
+            for sender in touched:
+                queue = self.senders.get(sender)
+                if not queue:
+                    continue
+                spent = nonce_of(sender)
+                for nonce in [n for n in queue if n < spent]:
+                    self._remove(queue[nonce])
+                    changed = True
+
+        if changed:
+            self._compact_heap()
+            self._save()
 
     # ============================
     # UTILITIES
     # ============================
 
+    def get(self, tx_id: str):
+        """Entrée {id, tx, received_at} en attente, ou None."""
+        return self.tx_index.get(tx_id)
+
+    def get_by_short_id(self, short_id: str):
+        """Entrée dont le tx_id commence par short_id (P2P_SHORT_ID_LEN caractères), ou None."""
+        tx_id = self._short_ids.get(short_id)
+        return self.tx_index.get(tx_id) if tx_id else None
+
+    def next_nonce(self, sender: str, state_nonce: int) -> int:
+        """Premier nonce libre après la suite contiguë en attente à partir de state_nonce."""
+        queue = self.senders.get(sender, {})
+        nonce = state_nonce
+        while nonce in queue:
+            nonce += 1
+        return nonce
+
     def count(self) -> int:
         self._purge_expired()
-        return len(self.transactions)
+        return len(self.tx_index)
 
     def stats(self) -> dict:
-        """Retourne des stats basiques sur la mempool."""
+        """Retourne des stats basiques sur la mempool (compteurs incrémentaux)."""
         self._purge_expired()
-        count = len(self.transactions)
-        ts_list = [e.get("received_at", 0) for e in self.transactions]
-        fees = [e.get("tx", {}).get("fee", 0) for e in self.transactions if isinstance(e.get("tx", {}).get("fee", 0), (int, float))]
+        count = len(self.tx_index)
+        oldest = newest = None
+        if self._buckets:
+            oldest_bucket = self._buckets[self._bucket_keys[0]]
+            if self._newest_bucket is None:
+                self._newest_bucket = max(self._buckets)
+            newest_bucket = self._buckets[self._newest_bucket]
+            oldest = min(e.get("received_at", 0) for e in oldest_bucket.values())
+            newest = max(e.get("received_at", 0) for e in newest_bucket.values())
+        if self._fee_bounds is None and self._fee_counts:
+            self._fee_bounds = (min(self._fee_counts), max(self._fee_counts))
+        fee_min, fee_max = self._fee_bounds if self._fee_counts else (0, 0)
         return {
             "count": count,
+            "senders": len(self.senders),
             "max_size": MEMPOOL_MAX_SIZE,
             "ttl_sec": MEMPOOL_TTL_SEC,
-            "oldest_ts": min(ts_list) if ts_list else None,
-            "newest_ts": max(ts_list) if ts_list else None,
+            "oldest_ts": oldest,
+            "newest_ts": newest,
             "fee": {
-                "max": max(fees) if fees else 0,
-                "min": min(fees) if fees else 0,
-                "avg": (sum(fees) / len(fees)) if fees else 0,
+                "max": fee_max,
+                "min": fee_min,
+                "avg": (self._fee_sum / count) if count else 0,
             },
         }
 
     def clear(self):
-        self.transactions = []
-        self.tx_index = set()
-        self._save()
+        self._reset()
+        self._compact()
 
     def list_transactions(self):
         """Return transactions sorted by priority (fee desc, oldest first)."""
@@ -1,13 +1,30 @@
 import asyncio
 import json
+import random
+import secrets
 import time
 import base64
 from pathlib import Path
-from typing import Dict, List
+from typing import Any, Dict, List, Optional, Union
 
 import websockets
+from nacl.signing import VerifyKey
 
-from .config import P2P_PORT, PEERS_FILE, P2P_PRIVKEY_ENV, P2P_BAN_THRESHOLD
+from .config import (
+    P2P_PORT,
+    PEERS_FILE,
+    P2P_PRIVKEY_ENV,
+    P2P_PEER_QUEUE_SIZE,
+    P2P_PING_INTERVAL,
+    P2P_PING_TIMEOUT,
+    P2P_RECONNECT_MIN_SEC,
+    P2P_RECONNECT_MAX_SEC,
+    P2P_SEND_TIMEOUT_SEC,
+    P2P_MAX_CONCURRENT_SENDS,
+    P2P_CODEC,
+)
+from .codec import FRAME_VERSION, PAYLOAD_CODECS, build_frame, parse_frame, encode_payload, decode_payload
+from .peer_guard import PeerGuard
 from .utils import load_signing_key, sign_message, verify_signature_raw
 from .validator_set import load_validators
 
@@ -25,18 +42,175 @@ def load_peers() -> List[str]:
     return []
 
 
+def peer_uri(peer: str, port: int = P2P_PORT) -> str:
+    """Un pair est un hôte (port P2P par défaut) ou hôte:port."""
+    return f"ws://{peer}" if ":" in peer else f"ws://{peer}:{port}"
+
+
+class OutMessage:
+    """
+    Message sortant, signé et encodé une seule fois par format (JSON texte des
+    anciens pairs, trame binaire par codec) quel que soit le nombre de destinataires.
+    """
+
+    def __init__(self, node: "P2PNode", msg_type: str, payload: dict):
+        self.node = node
+        self.type = msg_type
+        self.payload = payload
+        self.ts = int(time.time())
+        self._encoded: Dict[Optional[str], Union[str, bytes]] = {}
+
+    def encode(self, codec: Optional[str]) -> Union[str, bytes]:
+        raw = self._encoded.get(codec)
+        if raw is None:
+            raw = self._encoded[codec] = self.node._encode(self, codec)
+        return raw
+
+
+class PeerConnection:
+    """
+    Connexion sortante longue durée vers un pair :
+    - file d'envoi bornée (P2P_PEER_QUEUE_SIZE, le plus ancien message sort si pleine)
+    - ping WS (heartbeat), reconnexion avec backoff exponentiel + jitter
+    - envoi borné par P2P_SEND_TIMEOUT_SEC, compteurs de livraison (stats())
+    - les messages reçus sur cette socket sont traités comme ceux du serveur
+    """
+
+    def __init__(self, node: "P2PNode", host: str):
+        self.node = node
+        self.host = host
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=P2P_PEER_QUEUE_SIZE)
+        self.ws = None
+        self.dropped = 0
+        self.sent = 0
+        self.failed = 0
+        self.last_send_ms: Optional[float] = None
+        self.last_sent_at: Optional[float] = None
+        self.connected_at: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def connected(self) -> bool:
+        return self.ws is not None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+
+    def enqueue(self, msg: OutMessage) -> bool:
+        """Met un message en file (encodé à l'envoi selon le codec du pair) ; False si un ancien a dû être abandonné."""
+        dropped = False
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+            dropped = True
+        self.queue.put_nowait(msg)
+        return not dropped
+
+    def stats(self) -> dict:
+        return {
+            "host": self.host,
+            "connected": self.connected,
+            "queued": self.queue.qsize(),
+            "sent": self.sent,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "last_send_ms": self.last_send_ms,
+            "last_sent_at": self.last_sent_at,
+            "connected_at": self.connected_at,
+        }
+
+    async def _send(self, ws, raw: Union[str, bytes]):
+        """Un envoi : créneau global (P2P_MAX_CONCURRENT_SENDS) puis timeout propre à ce pair."""
+        async with self.node.send_slots:
+            started = time.monotonic()
+            try:
+                await asyncio.wait_for(ws.send(raw), P2P_SEND_TIMEOUT_SEC)
+            except Exception:
+                self.failed += 1
+                raise  # pair lent ou mort : on coupe, _run reconnecte
+            self.sent += 1
+            self.last_send_ms = round((time.monotonic() - started) * 1000, 2)
+            self.last_sent_at = time.time()
+
+    async def _run(self):
+        delay = P2P_RECONNECT_MIN_SEC
+        while True:
+            try:
+                async with websockets.connect(
+                    peer_uri(self.host, self.node.port),
+                    ping_interval=P2P_PING_INTERVAL,
+                    ping_timeout=P2P_PING_TIMEOUT,
+                ) as ws:
+                    if self.node.guard.is_banned(self.node.peer_addr(ws)):
+                        raise ConnectionRefusedError("banned peer")
+                    self.ws = ws
+                    self.connected_at = time.time()
+                    delay = P2P_RECONNECT_MIN_SEC
+                    try:
+                        await self.node._send_hello(ws)
+                        await self._pump(ws)
+                    finally:
+                        self.node.forget_socket(ws)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                pass
+            finally:
+                self.ws = None
+            await asyncio.sleep(delay * (0.5 + random.random()))
+            delay = min(delay * 2, P2P_RECONNECT_MAX_SEC)
+
+    async def _pump(self, ws):
+        """Écrit la file et lit la socket jusqu'à la fermeture de l'un des deux."""
+        async def writer():
+            while True:
+                msg = await self.queue.get()
+                await self._send(ws, msg.encode(self.node.codec_for(ws)))
+
+        async def reader():
+            async for raw in ws:
+                await self.node._process_message(raw, ws, inbound=False)
+
+        tasks = [asyncio.create_task(writer()), asyncio.create_task(reader())]
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                task.result()  # propage l'erreur de connexion
+        finally:
+            for task in tasks:
+                task.cancel()
+
+
 class P2PNode:
     """
     WebSocket P2P minimal :
-    - messages JSON signés (Ed25519)
-    - HELLO, BLOCK, TX, REQUEST_BLOCKS, REQUEST_HEADERS
-    - ban score simple sur messages invalides
+    - messages signés (Ed25519) : trame binaire (codec.py) négociée dans HELLO,
+      JSON texte pour les pairs qui n'annoncent pas de codec
+    - HELLO, INV, GETDATA, CMPCTBLOCK, GETBLOCKTXN, BLOCKTXN, BLOCK, TX,
+      REQUEST_BLOCKS, REQUEST_HEADERS
+    - débit limité par pair et par type, pairs bannis déconnectés (peer_guard.py)
+    - une connexion persistante par pair (PeerConnection) pour les envois :
+      broadcast ne fait que remplir les files, chaque pair est servi en parallèle
     """
 
-    def __init__(self, handler_callback):
+    def __init__(self, handler_callback, port: int = P2P_PORT):
         self.handler_callback = handler_callback
+        self.port = port
         self.peers = set(load_peers())
-        self.ban_score: Dict[str, int] = {}
+        self.connections: Dict[str, PeerConnection] = {}
+        self.send_slots = asyncio.Semaphore(P2P_MAX_CONCURRENT_SENDS)
+        # codec préféré (None : JSON texte uniquement) et codec retenu par socket après HELLO
+        self.codec = P2P_CODEC if P2P_CODEC in PAYLOAD_CODECS else None
+        self._ws_codec: Dict[Any, Optional[str]] = {}
+        self.loop = None
+        self.guard = PeerGuard()
+        self._ws_peer: Dict[Any, str] = {}    # socket -> clé P2P authentifiée (défi HELLO relevé)
+        self._ws_nonce: Dict[Any, str] = {}   # socket -> défi envoyé dans notre HELLO
         self.validators = load_validators()
         self.signing_key = None
         self.pubkey_b64 = None
@@ -51,8 +225,12 @@ class P2PNode:
         if not self.signing_key:
             print("[P2P] No private key set, P2P disabled")
             return
-        async with websockets.serve(self._handle_conn, "0.0.0.0", P2P_PORT):
-            print(f"[P2P] WebSocket server on {P2P_PORT}")
+        self.loop = asyncio.get_running_loop()
+        async with websockets.serve(
+            self._handle_conn, "0.0.0.0", self.port,
+            ping_interval=P2P_PING_INTERVAL, ping_timeout=P2P_PING_TIMEOUT,
+        ):
+            print(f"[P2P] WebSocket server on {self.port}")
             await asyncio.Future()  # run forever
 
     def _save_peers(self):
@@ -64,52 +242,197 @@ class P2PNode:
             self.peers.add(host)
             self._save_peers()
             print(f"[P2P] New peer {host}")
+            # add_peer peut être appelé hors de la boucle (handler dans l'executor)
+            if self.loop and self.signing_key:
+                self.loop.call_soon_threadsafe(self._connection, host)
+
+    def _connection(self, host: str) -> Optional[PeerConnection]:
+        """Connexion persistante vers host (créée et démarrée au besoin). Boucle asyncio uniquement."""
+        if not host or host == self._local_host():
+            return None
+        conn = self.connections.get(host)
+        if conn is None:
+            conn = self.connections[host] = PeerConnection(self, host)
+        conn.start()
+        return conn
 
     async def connect_peers(self):
         if not self.signing_key:
             return
+        self.loop = asyncio.get_running_loop()
         for peer in list(self.peers):
+            self._connection(peer)
+
+    def close(self):
+        for conn in self.connections.values():
+            conn.stop()
+
+    def peer_stats(self) -> List[dict]:
+        """Livraison par pair (envoyés, échecs, abandons, latence du dernier envoi)."""
+        return [conn.stats() for conn in list(self.connections.values())]
+
+    async def _handle_conn(self, websocket, path=None):
+        # path : ancienne signature de websockets.serve (< 13)
+        if self.guard.is_banned(self.peer_addr(websocket)):
             try:
-                async with websockets.connect(f"ws://{peer}:{P2P_PORT}") as ws:
-                    await self._send_hello(ws)
+                await asyncio.wait_for(websocket.close(code=1008, reason="banned"), P2P_SEND_TIMEOUT_SEC)
             except Exception:
-                continue
-
-    async def _handle_conn(self, websocket, path):
+                pass
+            return
         try:
             async for raw in websocket:
                 await self._process_message(raw, websocket)
         except Exception:
             return
+        finally:
+            self.forget_socket(websocket)
+
+    # ======================================
+    #             FORMAT DES MESSAGES
+    # ======================================
+
+    def codec_for(self, websocket) -> Optional[str]:
+        return self._ws_codec.get(websocket)
+
+    def authenticated_peer(self, websocket) -> Optional[str]:
+        """Clé P2P liée à la socket par le défi HELLO (None tant qu'il n'est pas relevé)."""
+        return self._ws_peer.get(websocket)
+
+    def forget_socket(self, websocket):
+        self._ws_codec.pop(websocket, None)
+        self._ws_peer.pop(websocket, None)
+        self._ws_nonce.pop(websocket, None)
+
+    def _pick_codec(self, hello: dict) -> Optional[str]:
+        """Codec binaire commun avec le pair (le nôtre en priorité), sinon None (JSON texte)."""
+        advertised = hello.get("codecs")
+        if self.codec is None or hello.get("wire") != FRAME_VERSION or not isinstance(advertised, list):
+            return None
+        if self.codec in advertised:
+            return self.codec
+        return next((c for c in advertised if c in PAYLOAD_CODECS), None)
+
+    def _encode(self, msg: OutMessage, codec: Optional[str]) -> Union[str, bytes]:
+        if codec is None:
+            return json.dumps(self._build_message(msg.type, msg.payload, msg.ts))
+        return build_frame(
+            msg.type,
+            encode_payload(msg.payload, codec),
+            msg.ts,
+            self.signing_key.verify_key.encode(),
+            codec,
+            lambda data: self.signing_key.sign(data).signature,
+        )
 
-    async def _process_message(self, raw: str, websocket):
+    def _verify_frame(self, frame) -> Optional[dict]:
+        """Trame binaire découpée -> message (même forme que le JSON texte) ; None si invalide."""
         try:
-            msg = json.loads(raw)
+            VerifyKey(frame.pubkey).verify(frame.signed, frame.signature)
+            payload = decode_payload(frame.payload, frame.codec)
         except Exception:
+            return None
+        sender = base64.urlsafe_b64encode(frame.pubkey).decode().rstrip("=")
+        return {"type": frame.msg_type, "payload": payload, "ts": frame.ts, "from": sender}
+
+    # ======================================
+    #             RÉCEPTION
+    # ======================================
+
+    @staticmethod
+    def peer_addr(websocket) -> str:
+        try:
+            return websocket.remote_address[0]
+        except Exception:
+            return ""
+
+    async def _process_message(self, raw: Union[str, bytes], websocket, inbound: bool = True):
+        # avant tout décodage : pair banni -> déconnecté ; débit global du pair
+        addr = self.peer_addr(websocket)
+        if self.guard.is_banned(addr, self._ws_peer.get(websocket)):
+            self._drop_banned(websocket)
+            return
+        if not self.guard.allow(addr):
+            return
+
+        # type lu sans vérifier la signature : débit par type avant le coût Ed25519
+        if isinstance(raw, (bytes, bytearray)):
+            try:
+                frame = parse_frame(raw)
+            except Exception:
+                self._penalize(websocket)
+                return
+            if not self.guard.allow(addr, frame.msg_type):
+                return
+            msg = self._verify_frame(frame)
+        else:
+            try:
+                msg = json.loads(raw)
+            except Exception:
+                msg = None
+            if isinstance(msg, dict):
+                if not self.guard.allow(addr, msg.get("type")):
+                    return
+                if not self._validate_message(msg):
+                    msg = None
+        if msg is None:
+            self._penalize(websocket)
             return
-        if not self._validate_message(msg):
-            sender = self._sender_from_msg(msg)
-            self._inc_ban(sender)
+
+        # signature valide, mais un message signé peut être rejoué sur une autre socket :
+        # la clé n'est liée à la socket qu'une fois notre défi HELLO signé en retour
+        sender = msg["from"]
+        hello = msg["payload"] if msg.get("type") == "HELLO" and isinstance(msg.get("payload"), dict) else None
+        if hello is not None:
+            nonce = self._ws_nonce.get(websocket)
+            if nonce and hello.get("ack") == nonce:
+                self._ws_peer[websocket] = sender
+        if self.guard.is_banned(sender):
+            # clé bannie : connexion coupée si c'est bien ce pair, sinon message ignoré
+            if self._ws_peer.get(websocket) == sender:
+                self._drop_banned(websocket)
             return
-        # dispatch to handler
-        self.handler_callback(msg)
+        if hello is not None:
+            self._ws_codec[websocket] = self._pick_codec(hello)
+        if sender == self.pubkey_b64:
+            return  # notre propre message (ex: pair configuré vers nous-mêmes)
+        # dispatch to handler (sync ou coroutine) ; la socket d'origine sert aux réponses (GETDATA)
+        result = self.handler_callback(msg, websocket)
+        if asyncio.iscoroutine(result):
+            await result
 
-        # respond to requests
-        if msg.get("type") == "HELLO":
-            sender_host = msg["payload"].get("host")
+        # respond to requests : HELLO entrant sans "ack" -> notre HELLO (défi + ack du sien) ;
+        # HELLO reçu en sortant avec un défi -> ack ; rien d'autre (sinon ping-pong de HELLO)
+        if hello is None:
+            return
+        if inbound and "ack" not in hello:
+            sender_host = hello.get("host")
             if sender_host:
                 self.add_peer(sender_host)
-            await self._send_hello(websocket)
+            await self._send_hello(websocket, ack=hello.get("nonce"))
+        elif not inbound and isinstance(hello.get("nonce"), str):
+            await self._send_hello(websocket, ack=hello["nonce"])
 
-    def _sender_from_msg(self, msg: dict):
-        return msg.get("from", "")
+    def _penalize(self, websocket, points: float = 1.0):
+        """
+        Message invalide : pénalise l'IP de la socket et, si le pair a relevé le défi
+        HELLO sur cette socket, sa clé P2P (jamais le "from" d'un message, qui peut être
+        rejoué) ; coupe la connexion si banni.
+        """
+        keys = [self.peer_addr(websocket), self._ws_peer.get(websocket)]
+        if self.guard.penalize(keys, points):
+            self._drop_banned(websocket)
 
-    def _inc_ban(self, sender: str):
-        if not sender:
-            return
-        self.ban_score[sender] = self.ban_score.get(sender, 0) + 1
-        if self.ban_score[sender] >= P2P_BAN_THRESHOLD:
-            print(f"[P2P] Banned {sender}")
+    def _drop_banned(self, websocket):
+        """
+        Coupe la connexion TCP sans handshake de fermeture : les messages déjà reçus
+        ne sont pas lus (la lecture est en pause tant qu'ils attendent, un close
+        propre attendrait jusqu'au timeout).
+        """
+        self.forget_socket(websocket)
+        try:
+            websocket.transport.abort()
+        except Exception:
+            pass
 
     def _validate_message(self, msg: dict) -> bool:
         required = {"type", "payload", "ts", "from", "sig"}
@@ -129,20 +452,29 @@ class P2PNode:
         except Exception:
             return False
 
-    async def _send_hello(self, websocket):
-        msg = self._build_message("HELLO", {"node": self.pubkey_b64, "host": self._local_host(), "ts": int(time.time())})
+    async def _send_hello(self, websocket, ack: Optional[str] = None):
+        # toujours en JSON texte (lisible par tous) ; annonce les codecs binaires acceptés.
+        # nonce : défi propre à cette socket, que le pair renvoie signé dans "ack"
+        nonce = self._ws_nonce.setdefault(websocket, secrets.token_hex(16))
+        hello = {"node": self.pubkey_b64, "host": self._local_host(), "ts": int(time.time()), "nonce": nonce}
+        if isinstance(ack, str):
+            hello["ack"] = ack
+        if self.codec:
+            hello.update({"wire": FRAME_VERSION, "codecs": list(PAYLOAD_CODECS)})
+        msg = self._build_message("HELLO", hello)
         await websocket.send(json.dumps(msg))
 
     def _local_host(self) -> str:
         return "127.0.0.1"  # placeholder; remplacer par IP publique si besoin
 
-    def _build_message(self, msg_type: str, payload: dict) -> dict:
+    def _build_message(self, msg_type: str, payload: dict, ts: int = None) -> dict:
+        """Message JSON texte (ancien format) : signature sur l'enveloppe re-sérialisée triée."""
         if not self.signing_key:
             raise RuntimeError("P2P signing key missing")
         base = {
             "type": msg_type,
             "payload": payload,
-            "ts": int(time.time()),
+            "ts": int(time.time()) if ts is None else ts,
             "from": self.pubkey_b64,
         }
         raw = json.dumps(base, sort_keys=True).encode()
@@ -150,26 +482,40 @@ class P2PNode:
         base["sig"] = sig
         return base
 
-    async def broadcast(self, msg_type: str, payload: dict):
+    async def broadcast(self, msg_type: str, payload: dict) -> int:
+        """
+        Signe une fois (par format), puis met le message dans la file de chaque pair et rend la main :
+        les writers des connexions l'envoient en parallèle, un pair lent ne retarde pas
+        les autres. Retourne le nombre de pairs servis.
+        """
         if not self.signing_key:
-            return
-        msg = self._build_message(msg_type, payload)
+            return 0
+        msg = OutMessage(self, msg_type, payload)
+        queued = 0
         for peer in list(self.peers):
-            try:
-                async with websockets.connect(f"ws://{peer}:{P2P_PORT}") as ws:
-                    await ws.send(json.dumps(msg))
-            except Exception:
-                continue
+            conn = self._connection(peer)
+            if conn:
+                conn.enqueue(msg)
+                queued += 1
+        return queued
 
     async def send_to(self, peer: str, msg_type: str, payload: dict):
+        """Envoi à un pair connu (peers.json) : jamais de connexion vers un hôte quelconque."""
+        if not self.signing_key or peer not in self.peers:
+            return
+        conn = self._connection(peer)
+        if conn:
+            conn.enqueue(OutMessage(self, msg_type, payload))
+
+    async def reply(self, websocket, msg_type: str, payload: dict):
+        """Réponse directe sur la socket d'où vient une requête (entrante ou sortante)."""
         if not self.signing_key:
             return
-        msg = self._build_message(msg_type, payload)
         try:
-            async with websockets.connect(f"ws://{peer}:{P2P_PORT}") as ws:
-                await ws.send(json.dumps(msg))
+            raw = OutMessage(self, msg_type, payload).encode(self.codec_for(websocket))
+            await asyncio.wait_for(websocket.send(raw), P2P_SEND_TIMEOUT_SEC)
         except Exception:
-            return
+            pass  # connexion fermée entre-temps : le pair redemandera
 
     # Convenience wrappers
     async def broadcast_block(self, block: dict):
@@ -1,8 +1,9 @@
 import asyncio
 import threading
-import time
 import json
-from pathlib import Path
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import uvicorn
 
 from .config import (
@@ -11,7 +12,19 @@ from .config import (
     NODE_NAME,
     P2P_PORT,
     MAX_ROLLBACK,
+    SNAPSHOT_INTERVAL,
     BLOCK_REWARD,
+    FULL_VERIFY,
+    P2P_INBOX_SIZE,
+    P2P_SEEN_CACHE_SIZE,
+    P2P_INV_INTERVAL_SEC,
+    P2P_INV_MAX_ITEMS,
+    P2P_GETDATA_TIMEOUT_SEC,
+    P2P_SHORT_ID_LEN,
+    P2P_COMPACT_PENDING,
+    SYNC_HEADERS_MAX,
+    SYNC_MAX_BLOCKS_PER_REQUEST,
+    NODE_IO_WORKERS,
 )
 from .ledger import Ledger
 from .mempool import Mempool
@@ -19,10 +32,12 @@ from .consensus import Consensus
 from .network_ws import P2PNode
 from .validator import Validator
 from .block import Block
-from .validator_set import load_validators, get_pubkey
-from .snapshot_manager import load_snapshot
-from .state import State
-from .utils import verify_signature_raw
+from .validator_set import load_validators, get_pubkey, select_producer, stake_of
+from .snapshot_manager import load_snapshot, save_snapshot, snapshot_path
+from .state import get_global_state
+from .utils import verify_signature_raw, compute_tx_id, LRUCache
+from .sync import SyncManager
+from .api import create_app
 
 
 class FRENode:
@@ -31,55 +46,72 @@ class FRENode:
     - API REST
     - boucle consensus
     - P2P WS (messages signés)
+
+    Ledger, Mempool et State sont partagés avec l'API (create_app) ; self.lock
+    sérialise la production de blocs, le handler P2P et les requêtes de l'API.
+
+    Une seule boucle asyncio porte l'API (uvicorn), le P2P et la production de
+    blocs ; le travail bloquant (écritures disque, vérifications) passe par un
+    ThreadPoolExecutor borné. Les messages P2P sont mis en file et traités dans
+    l'ordre d'arrivée, sans bloquer la lecture des connexions.
+
+    Gossip par inventaire : tx et blocs sont annoncés par hash (INV) et envoyés
+    seulement à qui les demande (GETDATA) ; `seen` évite de revalider un élément
+    reçu plusieurs fois. Les nouveaux blocs partent en bloc compact (CMPCTBLOCK),
+    reconstruit depuis la mempool du destinataire.
     """
 
-    def __init__(self):
+    def __init__(self, full_verify: bool = FULL_VERIFY):
         print(f"[FRE_NODE] Initialisation du node '{NODE_NAME}'...")
 
-        self.ledger = Ledger()
+        self.ledger = Ledger(full_verify=full_verify)
         self.mempool = Mempool()
         self.consensus = Consensus(self.ledger, self.mempool)
         self.validator = Validator()
         self.p2p = P2PNode(handler_callback=self.handle_network_message)
-        self.p2p_loop = None
+        self.loop = None
+        self.executor = ThreadPoolExecutor(max_workers=NODE_IO_WORKERS, thread_name_prefix="fre-io")
+        self.inbox = None
         self.validators = load_validators()
-        self.state = State()
+        self.state = get_global_state()
+        self.lock = threading.RLock()
+        # gossip : éléments déjà traités, demandés (clé -> instant), tx_id à annoncer
+        self.seen = LRUCache(P2P_SEEN_CACHE_SIZE)
+        self.requested = LRUCache(P2P_SEEN_CACHE_SIZE)
+        self._inv_pending = deque()
+        self.compact_pending = LRUCache(P2P_COMPACT_PENDING)  # hash -> (bloc sans tx, tx connues)
+        self.sync = SyncManager(self)
 
     # ======================================
-    #             DEMARRAGE API
+    #             EXECUTION BLOQUANTE
     # ======================================
 
-    def start_api(self):
-        print(f"[API] API REST démarrée sur http://0.0.0.0:{API_PORT}")
-        uvicorn.run(
-            "fre_node.api:app",
-            host="0.0.0.0",
-            port=API_PORT,
-            reload=False
-        )
-
-    # ======================================
-    #              DEMARRAGE P2P
-    # ======================================
-
-    def start_p2p(self):
-        print(f"[P2P] Démarrage du serveur WS sur {P2P_PORT}...")
-        loop = asyncio.new_event_loop()
-        self.p2p_loop = loop
-
-        async def runner():
-            await asyncio.gather(
-                self.p2p.start_server(),
-                self.p2p.connect_peers(),
-            )
-
-        threading.Thread(target=lambda: loop.run_until_complete(runner()), daemon=True).start()
+    async def _run_blocking(self, fn, *args):
+        """Exécute fn sous self.lock dans l'executor borné, sans bloquer la boucle."""
+        def locked():
+            with self.lock:
+                return fn(*args)
+        return await self.loop.run_in_executor(self.executor, locked)
 
     # ======================================
     #             MESSAGE P2P
     # ======================================
 
-    def handle_network_message(self, msg: dict):
+    async def handle_network_message(self, msg: dict, origin=None):
+        # file bornée : si le traitement prend du retard, la lecture des connexions attend
+        await self.inbox.put((msg, origin))
+
+    async def _process_inbox(self):
+        while True:
+            msg, origin = await self.inbox.get()
+            try:
+                await self._run_blocking(self._dispatch_message, msg, origin)
+            except Exception as e:
+                print(f"[P2P] Erreur traitement {msg.get('type')}: {e}")
+            finally:
+                self.inbox.task_done()
+
+    def _dispatch_message(self, msg: dict, origin=None):
         mtype = msg.get("type")
         payload = msg.get("payload", {})
 
@@ -87,99 +119,294 @@ class FRENode:
             host = payload.get("host")
             if host:
                 self.p2p.add_peer(host)
+        elif mtype == "INV":
+            self._handle_inv(payload.get("items", []), origin)
+        elif mtype == "GETDATA":
+            self._handle_getdata(payload.get("items", []), origin)
         elif mtype == "TX":
-            tx = payload
-            if self.validator.validate_transaction(tx):
-                if self.mempool.add_transaction(tx):
-                    self._broadcast_async("TX", tx)
+            self._handle_tx(payload)
+        elif mtype == "CMPCTBLOCK":
+            self._handle_compact_block(payload, origin)
+        elif mtype == "GETBLOCKTXN":
+            self._handle_getblocktxn(payload, origin)
+        elif mtype == "BLOCKTXN":
+            self._handle_blocktxn(payload, origin)
         elif mtype == "BLOCK":
-            blk = payload
-            self._handle_block(blk)
+            # marqué vu par _announce_block, une fois accepté
+            block_id = self._block_id(payload)
+            if block_id and block_id == payload.get("hash") and f"block:{block_id}" not in self.seen:
+                self._handle_block(payload)
         elif mtype == "REQUEST_BLOCKS":
             start = payload.get("from", 0)
-            end = payload.get("to", start + 10)
-            blocks = self.ledger.get_chain()[start:end]
-            host = payload.get("reply_to")
-            if host:
-                self._send_async(host, "BLOCKS", {"blocks": blocks})
+            end = min(payload.get("to", start + 10), start + SYNC_MAX_BLOCKS_PER_REQUEST)
+            blocks = self.ledger.get_blocks(start, end)
+            self._reply_async(origin, "BLOCKS", {"blocks": blocks})
         elif mtype == "BLOCKS":
-            for blk in payload.get("blocks", []):
-                self._handle_block(blk)
+            # pair identifié par la socket (défi HELLO), pas par le "from" rejouable
+            self.sync.on_blocks(self.p2p.authenticated_peer(origin), payload.get("blocks", []))
         elif mtype == "REQUEST_HEADERS":
             start = payload.get("from", 0)
-            end = payload.get("to", start + 50)
-            headers = [self._block_to_header(b) for b in self.ledger.get_chain()[start:end]]
-            host = payload.get("reply_to")
-            if host:
-                self._send_async(host, "HEADERS", {"headers": headers})
+            end = min(payload.get("to", start + 50), start + SYNC_HEADERS_MAX)
+            headers = [self._block_to_header(b) for b in self.ledger.get_blocks(start, end)]
+            tip = self.ledger.count_blocks() - 1
+            self._reply_async(origin, "HEADERS", {"headers": headers, "tip": tip})
         elif mtype == "HEADERS":
             headers = payload.get("headers", [])
-            self._handle_headers(headers)
+            self._handle_headers(headers, self.p2p.authenticated_peer(origin), origin, payload.get("tip"))
+
+    # ======================================
+    #             GOSSIP (INV / GETDATA)
+    # ======================================
+
+    def _mark_seen(self, kind: str, item_id) -> bool:
+        """Marque l'élément comme vu ; True s'il l'était déjà (rien à refaire)."""
+        key = f"{kind}:{item_id}"
+        if key in self.seen:
+            return True
+        self.seen.put(key, True)
+        self.requested.pop(key)
+        return False
+
+    @staticmethod
+    def _block_id(blk: dict):
+        """Hash recalculé du bloc (le "hash" annoncé n'engage que l'émetteur) ; None si malformé."""
+        try:
+            return Block.from_dict(blk).hash
+        except Exception:
+            return None
 
-    def _handle_block(self, blk: dict):
+    def _handle_tx(self, tx: dict):
+        # vue seulement une fois validée : une copie invalide (même tx_id, pubkey différente)
+        # ou un nonce arrivé trop tôt ne masquent pas la vraie tx
+        tx_id = compute_tx_id(tx)
+        if f"tx:{tx_id}" in self.seen:
+            return
+        pending = self.mempool.next_nonce(tx.get("from"), self.state.get_nonce(tx.get("from")))
+        if not self.validator.validate_transaction(tx, pending_nonce=pending):
+            return
+        self._mark_seen("tx", tx_id)
+        if self.mempool.add_transaction(tx):
+            self._inv_pending.append({"type": "tx", "id": tx_id})
+
+    def announce_tx(self, tx: dict):
+        """Tx acceptée hors P2P (API) : annoncée au prochain INV."""
+        tx_id = compute_tx_id(tx)
+        self._mark_seen("tx", tx_id)
+        self._inv_pending.append({"type": "tx", "id": tx_id})
+
+    def _known(self, kind: str, item: dict) -> bool:
+        if f"{kind}:{item['id']}" in self.seen:
+            return True
+        if kind == "tx":
+            return self.mempool.get(item["id"]) is not None or self.ledger.tx_index.get(item["id"]) is not None
+        height = item.get("height")
+        if isinstance(height, int):
+            latest = self.ledger.get_latest_block()
+            return latest is not None and height <= latest["index"]
+        return False
+
+    def _handle_inv(self, items: list, origin):
+        """Demande à l'émetteur de l'INV les éléments inconnus et pas déjà en cours de demande."""
+        now = time.time()
+        wanted = []
+        for item in items[:P2P_INV_MAX_ITEMS]:
+            if not isinstance(item, dict) or item.get("type") not in ("tx", "block") or not isinstance(item.get("id"), str):
+                continue
+            kind = item["type"]
+            if self._known(kind, item):
+                continue
+            key = f"{kind}:{item['id']}"
+            asked = self.requested.get(key)
+            if asked and now - asked < P2P_GETDATA_TIMEOUT_SEC:
+                continue
+            self.requested.put(key, now)
+            wanted.append(item)
+        if wanted:
+            self._reply_async(origin, "GETDATA", {"items": wanted})
+
+    def _handle_getdata(self, items: list, origin):
+        for item in items[:P2P_INV_MAX_ITEMS]:
+            if not isinstance(item, dict):
+                continue
+            if item.get("type") == "tx":
+                entry = self.mempool.get(item.get("id"))
+                if entry:
+                    self._reply_async(origin, "TX", entry["tx"])
+            elif item.get("type") == "block" and isinstance(item.get("height"), int):
+                blk = self.ledger.get_block(item["height"])
+                if blk and blk.get("hash") == item.get("id"):
+                    self._reply_async(origin, "BLOCK", blk)
+
+    def _announce_block(self, blk: dict):
+        """Pousse le bloc en compact : en-tête + préfixes des tx_id, sans corps de tx."""
+        self._mark_seen("block", blk["hash"])
+        header = {k: v for k, v in blk.items() if k != "txs"}
+        short_ids = [compute_tx_id(tx)[:P2P_SHORT_ID_LEN] for tx in blk.get("txs", [])]
+        self._broadcast_async("CMPCTBLOCK", {"header": header, "short_ids": short_ids})
+
+    # ======================================
+    #             BLOCS COMPACTS
+    # ======================================
+
+    def _handle_compact_block(self, payload: dict, origin):
+        header = payload.get("header")
+        short_ids = payload.get("short_ids")
+        if not isinstance(header, dict) or not isinstance(short_ids, list) or not isinstance(header.get("index"), int):
+            return
+        block_id = self._block_id(dict(header, txs=[]))  # hash porté par merkle_root, sans les tx
+        if block_id is None or block_id != header.get("hash") or f"block:{block_id}" in self.seen:
+            return
         latest = self.ledger.get_latest_block()
-        if latest and blk.get("index") <= latest.get("index", -1):
+        next_height = latest["index"] + 1 if latest else 0
+        if header["index"] < next_height:
             return
-        prev_block = self.ledger.get_block(blk["index"] - 1) if blk.get("index", 0) > 0 else None
-        if blk.get("index", 0) > 0 and not prev_block:
-            # demander les blocs manquants
-            self._broadcast_async("REQUEST_BLOCKS", {"from": 0, "to": blk["index"], "reply_to": ""})
+        if header["index"] > next_height:
+            self.sync.request_headers()  # trou : rattrapage par plages
             return
-        if not self.consensus.validate_block(blk, prev_block):
-            print("[P2P] Bloc invalide reçu")
+        entries = [self.mempool.get_by_short_id(sid) if isinstance(sid, str) else None for sid in short_ids]
+        txs = [entry["tx"] if entry else None for entry in entries]
+        missing = [i for i, tx in enumerate(txs) if tx is None]
+        if not missing:
+            self._complete_compact_block(header, txs, origin)
+            return
+        self.compact_pending.put(header["hash"], (header, txs))
+        self._reply_async(origin, "GETBLOCKTXN", {"hash": header["hash"], "height": header["index"], "indexes": missing})
+
+    def _handle_getblocktxn(self, payload: dict, origin):
+        height = payload.get("height")
+        blk = self.ledger.get_block(height) if isinstance(height, int) else None
+        if not blk or blk.get("hash") != payload.get("hash"):
+            return
+        txs = blk.get("txs", [])
+        indexes = [i for i in payload.get("indexes", []) if isinstance(i, int) and 0 <= i < len(txs)]
+        self._reply_async(origin, "BLOCKTXN", {"hash": blk["hash"], "indexes": indexes, "txs": [txs[i] for i in indexes]})
+
+    def _handle_blocktxn(self, payload: dict, origin):
+        pending = self.compact_pending.pop(payload.get("hash"))
+        if pending is None:
+            return
+        header, txs = pending
+        for i, tx in zip(payload.get("indexes", []), payload.get("txs", [])):
+            if isinstance(i, int) and 0 <= i < len(txs):
+                txs[i] = tx
+        if any(tx is None for tx in txs):
+            self._request_full_block(header, origin)
             return
-        if not self._apply_remote_block(blk):
-            print("[P2P] Echec application bloc")
+        self._complete_compact_block(header, txs, origin)
+
+    def _complete_compact_block(self, header: dict, txs: list, origin):
+        blk = dict(header, txs=txs)
+        if Block.compute_merkle_root(txs) != header.get("merkle_root"):
+            # collision de préfixe ou tx différente en mempool : bloc complet demandé
+            self._request_full_block(header, origin)
             return
+        self._handle_block(blk)
+
+    def _request_full_block(self, header: dict, origin):
+        self._reply_async(origin, "GETDATA", {"items": [{"type": "block", "id": header["hash"], "height": header["index"]}]})
+
+    async def sync_loop(self):
+        """Timeouts et redistribution des téléchargements, découverte périodique des tips."""
+        while True:
+            await asyncio.sleep(1)
+            try:
+                await self._run_blocking(self.sync.tick)
+            except Exception as e:
+                print(f"[SYNC] Erreur : {e}")
+
+    async def inv_loop(self):
+        """Annonce les nouvelles tx par lots (un INV signé pour plusieurs tx)."""
+        while True:
+            await asyncio.sleep(P2P_INV_INTERVAL_SEC)
+            while self._inv_pending:
+                items = []
+                while self._inv_pending and len(items) < P2P_INV_MAX_ITEMS:
+                    items.append(self._inv_pending.popleft())
+                await self.p2p.broadcast("INV", {"items": items})
+
+    def _handle_block(self, blk: dict, verified: bool = False) -> bool:
+        latest = self.ledger.get_latest_block()
+        if latest and blk.get("index") <= latest.get("index", -1):
+            return False
+        prev_block = self.ledger.get_block(blk["index"] - 1) if blk.get("index", 0) > 0 else None
+        if blk.get("index", 0) > 0 and not prev_block:
+            # trou : les pairs annoncent leur tip, le SyncManager télécharge la plage
+            self.sync.request_headers()
+            return False
+        if not verified and not self.consensus.validate_block(blk, prev_block):
+            print("[P2P] Bloc invalide reçu")
+            return False
+        # bloc appliqué en une transaction State : persisté au commit, annulé sinon
+        self.state.begin()
         try:
-            block_obj = Block(
-                index=blk["index"],
-                timestamp=blk["timestamp"],
-                txs=blk["txs"],
-                prev_hash=blk["prev_hash"],
-                validator=blk["validator"],
-                state_root=blk.get("state_root", ""),
-                merkle_root=blk.get("merkle_root"),
-                block_signature=blk.get("block_signature"),
-            )
-            added = self.ledger.add_block(block_obj)
-            if added:
-                self._broadcast_async("BLOCK", blk)  # propager
-            else:
-                # rollback si rejet
-                self._rollback_state(blk.get("index", 0))
+            if not self._apply_remote_block(blk):
+                self.state.abort()
+                print("[P2P] Echec application bloc")
+                return False
+            # signature/merkle déjà vérifiés par le consensus
+            added = self.ledger.add_block(Block.from_dict(blk), verified=True)
         except Exception:
+            self.state.abort()
+            return False
+        if not added:
+            self.state.abort()
+            return False
+        self.state.commit()
+        if blk["index"] % SNAPSHOT_INTERVAL == 0:
+            # comme le producteur : point de retour pour une réorganisation
+            save_snapshot(
+                {"balances": self.state.balances, "nonces": self.state.nonces, "state_root": blk.get("state_root", "")},
+                blk["index"],
+                producer_pub=self.p2p.pubkey_b64 or "",
+            )
+        # tx incluses (et nonces consommés) retirées de la mempool locale
+        self.mempool.remove_transactions(blk.get("txs", []), nonce_of=self.state.get_nonce)
+        self._announce_block(blk)  # propager (INV)
+        return True
+
+    def _handle_blocks(self, blocks: list):
+        """
+        Lot BLOCKS : la suite contiguë au tip local est vérifiée d'un coup
+        (signatures/merkle en parallèle), puis appliquée bloc par bloc.
+        """
+        latest = self.ledger.get_latest_block()
+        next_height = latest["index"] + 1 if latest else 0
+        pending = sorted(
+            (b for b in blocks if isinstance(b, dict) and isinstance(b.get("index"), int) and b["index"] >= next_height),
+            key=lambda b: b["index"],
+        )
+        run = []
+        for blk in pending:
+            if blk["index"] != next_height + len(run):
+                break
+            run.append(blk)
+        if not run:
+            for blk in pending:
+                self._handle_block(blk)
             return
 
-    def _broadcast_async(self, msg_type: str, payload: dict):
-        if self.p2p_loop:
-            asyncio.run_coroutine_threadsafe(self.p2p.broadcast(msg_type, payload), self.p2p_loop)
+        valid = self.consensus.validate_blocks(run, latest)
+        for blk in run[:valid]:
+            if not self._handle_block(blk, verified=True):
+                break
 
-    def _send_async(self, peer: str, msg_type: str, payload: dict):
-        if self.p2p_loop and peer:
-            asyncio.run_coroutine_threadsafe(self.p2p.send_to(peer, msg_type, payload), self.p2p_loop)
+    def _broadcast_async(self, msg_type: str, payload: dict):
+        # appelé depuis l'executor : l'envoi est planifié sur la boucle du node
+        if self.loop:
+            asyncio.run_coroutine_threadsafe(self.p2p.broadcast(msg_type, payload), self.loop)
 
-    def _get_stake(self, name: str) -> int:
-        for v in self.validators:
-            if v.get("name") == name:
-                return max(1, int(v.get("stake", 1)))
-        return 1
+    def _reply_async(self, origin, msg_type: str, payload: dict):
+        if self.loop and origin is not None:
+            asyncio.run_coroutine_threadsafe(self.p2p.reply(origin, msg_type, payload), self.loop)
 
     def _block_to_header(self, blk: dict):
-        pubkey = get_pubkey(self.validators, blk.get("validator", ""))
-        return {
-            "height": blk["index"],
-            "prev_hash": blk["prev_hash"],
-            "block_hash": blk["hash"],
-            "merkle_root": blk.get("merkle_root", ""),
-            "state_root": blk.get("state_root", ""),
-            "producer": pubkey or blk.get("validator", ""),
-            "timestamp": blk.get("timestamp", ""),
-            "signature": blk.get("block_signature", ""),
-        }
+        return self.ledger.block_header(blk)
 
     def _validate_header(self, header: dict, prev_header: dict = None) -> bool:
-        required = ["height", "prev_hash", "block_hash", "merkle_root", "state_root", "producer", "signature", "timestamp"]
+        required = [
+            "height", "prev_hash", "block_hash", "merkle_root", "state_root", "validator",
+            "total_fees", "block_reward", "producer", "signature", "timestamp",
+        ]
         if not all(k in header for k in required):
             return False
         if prev_header:
@@ -187,51 +414,109 @@ class FRENode:
                 return False
             if header["height"] != prev_header["height"] + 1:
                 return False
+        # producteur du slot (comme check_block pour les blocs), désigné par son nom et sa pubkey
+        if header["height"] > 0:
+            slot = select_producer(header["height"], self.validators, weighted=True)
+            if header["validator"] != slot or header["producer"] != get_pubkey(self.validators, slot):
+                return False
+        # height, prev_hash, roots... liés au hash signé : un hash valide n'est pas rejouable ailleurs
+        try:
+            computed = Block(
+                index=header["height"],
+                timestamp=header["timestamp"],
+                txs=[],
+                prev_hash=header["prev_hash"],
+                validator=header["validator"],
+                state_root=header["state_root"],
+                merkle_root=header["merkle_root"],
+                total_fees=header["total_fees"],
+                block_reward=header["block_reward"],
+            ).hash
+        except Exception:
+            return False
+        if computed != header["block_hash"]:
+            return False
         try:
             # signature porte sur le hash du bloc, vérifiée avec la pubkey du producteur
             return verify_signature_raw(header["producer"], header["block_hash"].encode(), header["signature"])
         except Exception:
             return False
 
-    def _handle_headers(self, headers: list):
+    def _handle_headers(self, headers: list, peer: str = None, origin=None, tip: int = None):
+        """
+        Headers-first : les headers validés sont rangés dans le HeaderStore avec leur
+        poids de stake cumulé ; la branche la plus lourde devient la meilleure et seuls
+        ses corps de blocs sont téléchargés (SyncManager).
+        """
         if not headers:
             return
         # validation basique de la chaîne de headers
         prev = None
         for h in headers:
-            if not self._validate_header(h, prev):
+            if not isinstance(h, dict) or not self._validate_header(h, prev):
                 return
             prev = h
 
-        remote_tip = headers[-1]["height"]
-        local_tip = (self.ledger.get_latest_block() or {"index": -1})["index"]
-        if remote_tip <= local_tip:
+        store = self.ledger.headers
+        first, last = headers[0], headers[-1]
+        parent = store.get(first["prev_hash"]) if first["height"] > 0 else {"weight": 0, "height": -1}
+        if parent is None or parent["height"] != first["height"] - 1:
+            # point d'attache inconnu : headers précédents demandés à ce pair (fenêtre MAX_ROLLBACK)
+            floor = self.ledger.count_blocks() - 1 - MAX_ROLLBACK
+            if first["height"] > max(floor, 0):
+                start = max(first["height"] - SYNC_HEADERS_MAX, floor, 0)
+                self._reply_async(origin, "REQUEST_HEADERS", {"from": start, "to": first["height"]})
             return
-        if remote_tip - local_tip > MAX_ROLLBACK:
-            return
-
-        # poids stake sur la fenêtre comparée
-        remote_weight = sum(self._get_stake(h.get("producer", "")) for h in headers)
-        # local weight pour même fenêtre
-        chain = self.ledger.get_chain()
-        window = chain[max(0, len(chain) - len(headers)) :]
-        local_weight = sum(self._get_stake(b.get("validator", "")) for b in window)
 
-        if remote_tip > local_tip or (remote_tip == local_tip and remote_weight > local_weight):
-            # demander les blocs manquants
-            self._broadcast_async("REQUEST_BLOCKS", {"from": local_tip + 1, "to": remote_tip, "reply_to": ""})
+        weight = parent["weight"]
+        for h in headers:
+            weight += stake_of(self.validators, h["producer"]) or 1  # genesis : même règle que le ledger
+            store.add(h, weight)
+        best = store.tip()
+        if best is None or weight > best["weight"]:
+            fork = store.set_best(last["block_hash"])
+            if best and fork < best["height"]:
+                print(f"[SYNC] Branche plus lourde #{last['height']} (poids {weight} > {best['weight']}), fork à #{fork}")
+
+        remote_tip = max(tip, last["height"]) if isinstance(tip, int) else last["height"]
+        if remote_tip > last["height"]:
+            # suite des headers avant les corps
+            self._reply_async(origin, "REQUEST_HEADERS", {"from": last["height"] + 1, "to": last["height"] + 1 + SYNC_HEADERS_MAX})
+        self.sync.on_tip(peer, origin, remote_tip)
+        self._follow_best_chain()
+
+    def _follow_best_chain(self):
+        """Aligne la chaîne locale sur la meilleure branche : rollback au fork si besoin, puis téléchargement."""
+        store = self.ledger.headers
+        best = store.tip()
+        latest = self.ledger.get_latest_block()
+        if best is None or (latest and best["block_hash"] == latest["hash"]):
+            return
+        local_tip = latest["index"] if latest else -1
+        fork = min(local_tip, best["height"])
+        while fork >= 0 and store.best_hash(fork) != self.ledger.store.entry(fork)[3]:
+            fork -= 1
+        if fork < local_tip:
+            if local_tip - fork > MAX_ROLLBACK:
+                print(f"[SYNC] Fork à #{fork} au-delà de MAX_ROLLBACK, branche ignorée")
+                return
+            if not self._rollback_state(fork):
+                print(f"[SYNC] Pas de snapshot pour revenir à #{fork}, réorganisation impossible")
+                return
+            print(f"[SYNC] Réorganisation : chaîne locale ramenée à #{self.ledger.count_blocks() - 1}")
+        self.sync.set_target(best["height"])
 
     def _apply_remote_block(self, blk: dict) -> bool:
-        # sauvegarde état avant application
-        balances_backup = dict(self.state.balances)
-        nonces_backup = dict(self.state.nonces)
+        """Rejoue les tx du bloc dans la transaction State ouverte par l'appelant."""
         total_fees = 0
-        for tx in blk.get("txs", []):
-            if not self.validator.validate_transaction(tx):
-                self.state.restore(balances_backup, nonces_backup)
+        txs = blk.get("txs", [])
+        # format + signatures du bloc vérifiés en lot, nonce/balance dans l'ordre d'application
+        if not all(self.validator.validate_transactions(txs, check_clock=False)):
+            return False
+        for tx in txs:
+            if not self.validator.check_state(tx):
                 return False
             if not self.state.apply_transaction(tx):
-                self.state.restore(balances_backup, nonces_backup)
                 return False
             total_fees += tx.get("fee", 0)
 
@@ -239,9 +524,8 @@ class FRENode:
         if reward_total > 0:
             self.state.credit(blk.get("validator", ""), reward_total)
 
-        computed_root = self.state.compute_state_root()
+        computed_root = self.state.compute_state_root(blk.get("index"))
         if blk.get("state_root") and blk.get("state_root") != computed_root:
-            self.state.restore(balances_backup, nonces_backup)
             return False
 
         return True
@@ -250,47 +534,77 @@ class FRENode:
         # rollback using latest snapshot not deeper than MAX_ROLLBACK
         snap_height = None
         for h in range(target_height, max(-1, target_height - MAX_ROLLBACK - 1), -1):
-            path = f"db/snapshots/snap-{h}.json"
-            if Path(path).exists():
+            if snapshot_path(h).exists():
                 snap_height = h
                 break
         if snap_height is None:
-            return
+            return False
         snap = load_snapshot(snap_height)
-        if snap:
-            self.state.restore(snap.get("balances", {}), snap.get("nonces", {}))
-            self.ledger.truncate(snap_height)
+        if not snap:
+            return False
+        self.state.restore(snap.get("balances", {}), snap.get("nonces", {}))
+        self.ledger.truncate(snap_height)
+        return True
 
     # ======================================
     #           BOUCLE VALIDATEUR
     # ======================================
 
-    def block_loop(self):
+    def _produce_block(self):
+        if self.mempool.count() == 0:
+            return None
+        return self.consensus.produce_block()
+
+    async def block_loop(self):
         print(f"[CONSENSUS] Boucle de production de blocs → intervalle {BLOCK_INTERVAL}s")
 
         while True:
-            time.sleep(BLOCK_INTERVAL)
-
-            if self.mempool.count() == 0:
+            await asyncio.sleep(BLOCK_INTERVAL)
+            try:
+                new_block = await self._run_blocking(self._produce_block)
+            except Exception as e:
+                print(f"[CONSENSUS] Erreur production de bloc : {e}")
                 continue
-
-            new_block = self.consensus.produce_block()
             if new_block:
                 print(f"[BLOCK] Nouveau bloc #{new_block['index']} → hash={new_block['hash'][:12]}...")
-                self._broadcast_async("BLOCK", new_block)
+                self._announce_block(new_block)
 
     # ======================================
     #            LANCEMENT GLOBAL
     # ======================================
 
-    def start(self):
-        print("[FRE_NODE] Démarrage complet du nœud...")
+    async def run(self):
+        self.loop = asyncio.get_running_loop()
+        self.inbox = asyncio.Queue(maxsize=P2P_INBOX_SIZE)
 
-        threading.Thread(target=self.start_p2p, daemon=True).start()
-        threading.Thread(target=self.block_loop, daemon=True).start()
+        print(f"[P2P] Démarrage du serveur WS sur {P2P_PORT}...")
+        tasks = [
+            asyncio.create_task(self.p2p.start_server()),
+            asyncio.create_task(self.p2p.connect_peers()),
+            asyncio.create_task(self._process_inbox()),
+            asyncio.create_task(self.block_loop()),
+            asyncio.create_task(self.inv_loop()),
+            asyncio.create_task(self.sync_loop()),
+        ]
+
+        # API REST dans la même boucle ; son arrêt (signal) arrête le node
+        print(f"[API] API REST démarrée sur http://0.0.0.0:{API_PORT}")
+        server = uvicorn.Server(uvicorn.Config(create_app(self), host="0.0.0.0", port=API_PORT))
+        try:
+            await server.serve()
+        finally:
+            self.p2p.close()
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self.executor.shutdown(wait=True)
 
-        # API REST (bloquante)
-        self.start_api()
+    def start(self):
+        print("[FRE_NODE] Démarrage complet du nœud...")
+        try:
+            asyncio.run(self.run())
+        except KeyboardInterrupt:
+            print("[FRE_NODE] Arrêt du nœud.")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,171 @@
+import ipaddress
+import json
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+from .config import (
+    BANS_FILE,
+    P2P_BAN_THRESHOLD,
+    P2P_BAN_DURATION_SEC,
+    P2P_BAN_HALF_LIFE_SEC,
+    P2P_RATE_PENALTY,
+    P2P_PEER_RATE,
+    P2P_TYPE_RATES,
+    P2P_RATE_TRACKED,
+)
+from .utils import LRUCache
+
+
+class TokenBucket:
+    """Seau à jetons : `rate` jetons par seconde, au plus `burst` en réserve."""
+
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self, cost: float = 1.0) -> bool:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < cost:
+            return False
+        self.tokens -= cost
+        return True
+
+
+class PeerGuard:
+    """
+    Protection de la couche P2P contre les pairs abusifs :
+    - débit limité par pair (tous messages, avant décodage) et par type de message
+      (avant la vérification de signature) : message au-delà -> ignoré et pénalisé
+    - score de mauvaise conduite par clé (IP ou clé publique P2P), qui décroît avec
+      le temps (demi-vie P2P_BAN_HALF_LIFE_SEC)
+    - score >= P2P_BAN_THRESHOLD : bannissement pour P2P_BAN_DURATION_SEC, persisté
+      dans bans.json (survit au redémarrage), levé automatiquement à expiration
+    - adresses loopback exemptées (débit et ban par IP) : plusieurs nodes d'une même
+      machine partagent 127.0.0.1 ; leurs clés P2P restent pénalisables
+
+    Utilisé depuis la boucle asyncio ; la liste des bans est aussi lue par l'API.
+    """
+
+    def __init__(self, path: str = BANS_FILE):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._buckets = LRUCache(P2P_RATE_TRACKED)
+        self._scores = LRUCache(P2P_RATE_TRACKED)  # clé -> (score, time.time() du calcul)
+        self._bans: Dict[str, float] = {}     # clé -> fin du ban (timestamp)
+        self._load()
+
+    @staticmethod
+    def _loopback(key: str) -> bool:
+        try:
+            return ipaddress.ip_address(key).is_loopback
+        except ValueError:
+            return False  # clé P2P
+
+    # ======================================
+    #             PERSISTANCE
+    # ======================================
+
+    def _load(self):
+        if not self.path.exists():
+            return
+        try:
+            data = json.loads(self.path.read_text())
+        except Exception:
+            return
+        now = time.time()
+        if isinstance(data, dict):
+            self._bans = {k: float(v) for k, v in data.items() if isinstance(v, (int, float)) and v > now}
+
+    def _save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.path.write_text(json.dumps(self._bans, indent=2, sort_keys=True))
+
+    # ======================================
+    #             DÉBIT
+    # ======================================
+
+    def allow(self, addr: str, msg_type: Optional[str] = None) -> bool:
+        """
+        Un message de `addr` (de type msg_type, ou tous types si None) peut-il être traité ?
+        Les types sans limite propre ne sont soumis qu'à la limite globale du pair.
+        """
+        if self._loopback(addr):
+            return True
+        if msg_type is None:
+            limit = P2P_PEER_RATE
+        else:
+            limit = P2P_TYPE_RATES.get(msg_type)
+            if limit is None:
+                return True
+        key = (addr, msg_type)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(*limit)
+            self._buckets.put(key, bucket)
+        if bucket.take():
+            return True
+        self.penalize([addr], P2P_RATE_PENALTY)
+        return False
+
+    # ======================================
+    #             SCORE ET BANS
+    # ======================================
+
+    def _score(self, key: str, now: float) -> float:
+        score, at = self._scores.get(key, (0.0, now))
+        return score * 0.5 ** ((now - at) / P2P_BAN_HALF_LIFE_SEC)
+
+    def penalize(self, keys: Iterable[str], points: float = 1.0) -> bool:
+        """Ajoute `points` au score de chaque clé ; True si elles viennent d'être bannies."""
+        keys = [k for k in keys if k and not self._loopback(k)]
+        if not keys:
+            return False
+        now = time.time()
+        with self._lock:
+            crossed = False
+            for key in keys:
+                score = self._score(key, now) + points
+                self._scores.put(key, (score, now))
+                crossed = crossed or score >= P2P_BAN_THRESHOLD
+        if crossed:
+            self.ban(keys)
+        return crossed
+
+    def ban(self, keys: Iterable[str], duration: float = P2P_BAN_DURATION_SEC):
+        until = time.time() + duration
+        with self._lock:
+            for key in keys:
+                self._bans[key] = until
+                self._scores.pop(key, None)
+                print(f"[P2P] Banned {key} for {int(duration)}s")
+            self._save()
+
+    def is_banned(self, *keys: Optional[str]) -> bool:
+        if not self._bans:
+            return False
+        now = time.time()
+        banned = False
+        with self._lock:
+            for key in keys:
+                until = self._bans.get(key) if key and not self._loopback(key) else None
+                if until is None:
+                    continue
+                if until > now:
+                    banned = True
+                else:
+                    del self._bans[key]  # ban expiré
+                    self._save()
+        return banned
+
+    def bans(self) -> List[dict]:
+        now = time.time()
+        with self._lock:
+            return [{"peer": k, "until": int(v)} for k, v in sorted(self._bans.items()) if v > now]
@@ -1,7 +1,23 @@
 import json
 import os
 import hashlib
-from .config import STATE_FILE, INITIAL_BALANCE
+from collections import OrderedDict
+from .config import STATE_FILE, INITIAL_BALANCE, STATE_ROOT_SMT_HEIGHT, MAX_ROLLBACK
+from .state_tree import SparseMerkleTree
+
+
+class StateOverlay:
+    """
+    Couche copy-on-write d'un bloc : seuls les comptes touchés y sont copiés.
+    Fusionnée dans l'état de base au commit, simplement jetée à l'abort.
+    """
+
+    def __init__(self, tree: SparseMerkleTree = None):
+        self.balances = {}
+        self.nonces = {}
+        self.tree = tree          # copie (O(1)) de l'arbre de base au begin
+        self.pending = set()      # feuilles à remettre à jour dans self.tree
+
 
 class State:
     """
@@ -9,11 +25,20 @@ class State:
     - balances
     - nonces
     - state_root
+
+    self.balances / self.nonces contiennent l'état commité ; pendant un bloc
+    (begin) les écritures vont dans une StateOverlay lue en priorité.
+    Si STATE_ROOT_SMT_HEIGHT >= 0, un arbre de Merkle creux est tenu à jour
+    paresseusement : seules les feuilles des comptes modifiés sont recalculées.
     """
 
     def __init__(self):
         self.balances = {}
         self.nonces = {}
+        self._overlay = None   # transaction de bloc ouverte (begin)
+        self._tree = None      # SparseMerkleTree de l'état commité (si activé)
+        self._pending = set()
+        self._tree_history = OrderedDict()  # racine -> arbre des derniers blocs commités
 
         if not os.path.exists(STATE_FILE):
             self._create_initial_state()
@@ -27,6 +52,7 @@ class State:
     def _create_initial_state(self):
         self.balances = {}
         self.nonces = {}
+        self._rebuild_tree()
         self._save()
         print("[STATE] Nouveau state.json généré.")
 
@@ -35,19 +61,99 @@ class State:
             data = json.load(f)
             self.balances = data.get("balances", {})
             self.nonces = data.get("nonces", {})
+        self._rebuild_tree()
+
+    def _rebuild_tree(self):
+        self._pending = set()
+        self._tree_history = OrderedDict()
+        if STATE_ROOT_SMT_HEIGHT < 0:
+            self._tree = None
+            return
+        self._tree = SparseMerkleTree.from_accounts(self.balances, self.nonces)
 
     def _save(self):
-        with open(STATE_FILE, "w") as f:
+        # dans un bloc, l'écriture est différée au commit
+        if self._overlay is not None:
+            return
+        self._write()
+
+    def _write(self):
+        """Écriture atomique (tmp + replace) comme le ledger."""
+        tmp_path = STATE_FILE + ".tmp"
+        with open(tmp_path, "w") as f:
             json.dump({
                 "balances": self.balances,
                 "nonces": self.nonces
             }, f, indent=4)
+        os.replace(tmp_path, STATE_FILE)
+
+    # ============================
+    # TRANSACTION DE BLOC
+    # ============================
+
+    def begin(self):
+        """Ouvre une transaction de bloc : les mutations vont dans une overlay."""
+        if self._overlay is not None:
+            raise RuntimeError("State: transaction de bloc déjà ouverte")
+        tree = None
+        if self._tree is not None:
+            self._flush_tree(self._tree, self._pending)
+            tree = self._tree.copy()
+        self._overlay = StateOverlay(tree)
+
+    def commit(self):
+        """Fusionne l'overlay (O(comptes touchés)) puis persiste en une seule écriture."""
+        overlay, self._overlay = self._overlay, None
+        if overlay is None:
+            return
+        if overlay.balances or overlay.nonces:
+            self.balances.update(overlay.balances)
+            self.nonces.update(overlay.nonces)
+            if overlay.tree is not None:
+                self._tree = overlay.tree
+                self._pending = overlay.pending
+            self._write()
+        self._remember_tree()
+
+    def abort(self):
+        """Abandonne le bloc : l'overlay est jetée, l'état de base n'a pas bougé."""
+        self._overlay = None
+
+    def _has_account(self, addr: str) -> bool:
+        if self._overlay is not None and addr in self._overlay.balances:
+            return True
+        return addr in self.balances
+
+    def _set_balance(self, addr: str, value: int):
+        target = self._overlay.balances if self._overlay is not None else self.balances
+        target[addr] = value
+        self._mark_dirty(addr)
+
+    def _set_nonce(self, addr: str, value: int):
+        target = self._overlay.nonces if self._overlay is not None else self.nonces
+        target[addr] = value
+        self._mark_dirty(addr)
+
+    def _mark_dirty(self, addr: str):
+        if self._tree is None:
+            return
+        if self._overlay is not None:
+            self._overlay.pending.add(addr)
+        else:
+            self._pending.add(addr)
+
+    def _flush_tree(self, tree: SparseMerkleTree, pending: set):
+        """Recalcule les feuilles modifiées (O(k log n)) avec la vue courante."""
+        tree.update_many(pending, self.get_balance, self.get_nonce)
+        pending.clear()
 
     # ============================
     # BALANCES
     # ============================
 
     def get_balance(self, addr: str) -> int:
+        if self._overlay is not None and addr in self._overlay.balances:
+            return self._overlay.balances[addr]
         return self.balances.get(addr, 0)
 
     def create_wallet_if_needed(self, addr: str, initial_balance: int = 0):
@@ -56,24 +162,26 @@ class State:
         En mode normal on ne cr?dite pas par d?faut pour ?viter la cr?ation mon?taire
         implicite. initial_balance est utile en mode dev/tests.
         """
-        if addr not in self.balances:
-            self.balances[addr] = max(initial_balance, 0)
-            self.nonces[addr] = 0
+        if not self._has_account(addr):
+            self._set_balance(addr, max(initial_balance, 0))
+            self._set_nonce(addr, 0)
             self._save()
 
     def credit(self, addr: str, amount: int):
         """Crédite un wallet (rewards/fees)."""
         if amount <= 0:
             return
-        if addr not in self.balances:
+        if not self._has_account(addr):
             self.create_wallet_if_needed(addr)
-        self.balances[addr] += amount
+        self._set_balance(addr, self.get_balance(addr) + amount)
         self._save()
 
     def restore(self, balances: dict, nonces: dict):
         """Restaure l'état depuis un snapshot."""
+        self._overlay = None
         self.balances = balances or {}
         self.nonces = nonces or {}
+        self._rebuild_tree()
         self._save()
 
     # ============================
@@ -81,25 +189,65 @@ class State:
     # ============================
 
     def get_nonce(self, addr: str) -> int:
+        if self._overlay is not None and addr in self._overlay.nonces:
+            return self._overlay.nonces[addr]
         return self.nonces.get(addr, 0)
 
     def increment_nonce(self, addr: str):
-        if addr not in self.nonces:
-            self.nonces[addr] = 1
-        else:
-            self.nonces[addr] += 1
+        self._set_nonce(addr, self.get_nonce(addr) + 1)
         self._save()
 
     # ============================
     # STATE ROOT
     # ============================
 
-    def compute_state_root(self) -> str:
+    def compute_state_root(self, height: int = None) -> str:
+        """
+        Racine de l'état pour le bloc `height` : racine SMT à partir de
+        STATE_ROOT_SMT_HEIGHT, sinon hash du JSON trié (format historique).
+        """
+        if self._tree is not None and (height is None or height >= STATE_ROOT_SMT_HEIGHT):
+            if self._overlay is not None:
+                self._flush_tree(self._overlay.tree, self._overlay.pending)
+                return self._overlay.tree.root_hash()
+            self._flush_tree(self._tree, self._pending)
+            return self._tree.root_hash()
+        return self._legacy_state_root()
+
+    def _remember_tree(self):
+        """Garde les arbres des MAX_ROLLBACK derniers commits (noeuds partagés, O(k log n) chacun)."""
+        if self._tree is None:
+            return
+        self._flush_tree(self._tree, self._pending)
+        root = self._tree.root_hash()
+        self._tree_history[root] = self._tree.copy()
+        self._tree_history.move_to_end(root)
+        while len(self._tree_history) > MAX_ROLLBACK:
+            self._tree_history.popitem(last=False)
+
+    def tree_at(self, state_root: str):
+        """Arbre SMT (courant ou récent) dont la racine vaut state_root, sinon None."""
+        if self._tree is None:
+            return None
+        tree = self._tree_history.get(state_root)
+        if tree is not None:
+            return tree
+        if self._overlay is None:
+            self._flush_tree(self._tree, self._pending)
+            if self._tree.root_hash() == state_root:
+                return self._tree.copy()
+        return None
+
+    def _legacy_state_root(self) -> str:
         """Retourne un hash unique de l'état (comme un Merkle simplifié)."""
+        balances, nonces = self.balances, self.nonces
+        if self._overlay is not None:
+            balances = {**self.balances, **self._overlay.balances}
+            nonces = {**self.nonces, **self._overlay.nonces}
 
         data_string = json.dumps({
-            "balances": self.balances,
-            "nonces": self.nonces
+            "balances": balances,
+            "nonces": nonces
         }, sort_keys=True).encode()
 
         return hashlib.sha256(data_string).hexdigest()
@@ -114,20 +262,24 @@ class State:
         amount = tx["amount"]
         fee = tx.get("fee", 0)
 
-        if sender not in self.balances:
+        if not self._has_account(sender):
+            return False
+
+        # exécution strictement dans l'ordre des nonces
+        if tx.get("nonce") != self.get_nonce(sender):
             return False
 
         total = amount + fee
-        if self.balances[sender] < total:
+        if self.get_balance(sender) < total:
             return False
 
         # Débit (amount + fee)
-        self.balances[sender] -= total
+        self._set_balance(sender, self.get_balance(sender) - total)
 
         # Crédit destinataire (amount)
-        if receiver not in self.balances:
+        if not self._has_account(receiver):
             self.create_wallet_if_needed(receiver)
-        self.balances[receiver] += amount
+        self._set_balance(receiver, self.get_balance(receiver) + amount)
 
         # Les fees sont brûlées (pas de redistribution dans cette version)
 
@@ -0,0 +1,113 @@
+from typing import Dict, Iterable, Optional
+
+from .utils import SMT_EMPTY, smt_key, smt_leaf_hash, smt_node_hash, smt_bit
+
+
+class _Leaf:
+    __slots__ = ("key", "balance", "nonce", "hash")
+
+    def __init__(self, key: bytes, balance: int, nonce: int):
+        self.key = key
+        self.balance = balance
+        self.nonce = nonce
+        self.hash = smt_leaf_hash(key, balance, nonce)
+
+
+class _Node:
+    __slots__ = ("left", "right", "hash")
+
+    def __init__(self, left, right):
+        self.left = left
+        self.right = right
+        self.hash = smt_node_hash(_hash(left), _hash(right))
+
+
+def _hash(node) -> bytes:
+    return SMT_EMPTY if node is None else node.hash
+
+
+def _split(a: _Leaf, b: _Leaf, depth: int):
+    """Sous-arbre minimal contenant deux feuilles de clés différentes."""
+    bit_a, bit_b = smt_bit(a.key, depth), smt_bit(b.key, depth)
+    if bit_a == bit_b:
+        child = _split(a, b, depth + 1)
+        return _Node(child, None) if bit_a == 0 else _Node(None, child)
+    return _Node(a, b) if bit_a == 0 else _Node(b, a)
+
+
+def _insert(node, depth: int, leaf: _Leaf):
+    if node is None:
+        return leaf
+    if isinstance(node, _Leaf):
+        if node.key == leaf.key:
+            return leaf
+        return _split(node, leaf, depth)
+    if smt_bit(leaf.key, depth):
+        return _Node(node.left, _insert(node.right, depth + 1, leaf))
+    return _Node(_insert(node.left, depth + 1, leaf), node.right)
+
+
+class SparseMerkleTree:
+    """
+    Arbre de Merkle creux indexé par sha256(adresse), feuilles = (balance, nonce).
+    Un sous-arbre ne contenant qu'une feuille est représenté par la feuille
+    elle-même : profondeur ~log2(n). Les noeuds sont immuables, une mise à jour
+    recopie seulement le chemin modifié (O(log n)) : une racine conservée reste
+    une vue valide de l'état à ce moment-là (overlay de bloc, historique).
+    """
+
+    def __init__(self, root=None):
+        self.root = root
+
+    @classmethod
+    def from_accounts(cls, balances: Dict[str, int], nonces: Dict[str, int]):
+        tree = cls()
+        for addr, balance in balances.items():
+            tree.update(addr, balance, nonces.get(addr, 0))
+        return tree
+
+    def copy(self):
+        return SparseMerkleTree(self.root)
+
+    def update(self, address: str, balance: int, nonce: int):
+        self.root = _insert(self.root, 0, _Leaf(smt_key(address), balance, nonce))
+
+    def update_many(self, accounts: Iterable[str], get_balance, get_nonce):
+        for addr in accounts:
+            self.update(addr, get_balance(addr), get_nonce(addr))
+
+    def root_hash(self) -> str:
+        return _hash(self.root).hex()
+
+    def get(self, address: str) -> Optional[_Leaf]:
+        key = smt_key(address)
+        node, depth = self.root, 0
+        while isinstance(node, _Node):
+            node = node.right if smt_bit(key, depth) else node.left
+            depth += 1
+        if isinstance(node, _Leaf) and node.key == key:
+            return node
+        return None
+
+    def prove(self, address: str) -> dict:
+        """
+        Preuve d'inclusion (ou d'absence) de `address` contre root_hash().
+        siblings : hash des frères de la racine vers la feuille ; leaf : feuille
+        trouvée sur le chemin (celle de l'adresse, une autre, ou None si vide).
+        Vérifiable avec utils.verify_state_proof.
+        """
+        key = smt_key(address)
+        node, depth = self.root, 0
+        siblings = []
+        while isinstance(node, _Node):
+            if smt_bit(key, depth):
+                siblings.append(_hash(node.left).hex())
+                node = node.right
+            else:
+                siblings.append(_hash(node.right).hex())
+                node = node.left
+            depth += 1
+        leaf = None
+        if isinstance(node, _Leaf):
+            leaf = {"key": node.key.hex(), "balance": node.balance, "nonce": node.nonce}
+        return {"siblings": siblings, "leaf": leaf}
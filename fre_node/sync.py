@@ -0,0 +1,210 @@
+import time
+from typing import Dict, Optional
+
+from .config import (
+    SYNC_CHUNK_SIZE,
+    SYNC_WINDOW_CHUNKS,
+    SYNC_MAX_INFLIGHT_PER_PEER,
+    SYNC_REQUEST_TIMEOUT_SEC,
+    SYNC_MAX_PEER_FAILURES,
+    SYNC_HEADERS_MAX,
+    SYNC_POLL_SEC,
+)
+
+
+class SyncManager:
+    """
+    Synchronisation des blocs par plages, depuis plusieurs pairs à la fois :
+    - REQUEST_HEADERS (diffusé) : chaque pair répond avec ses headers et son tip ;
+      le node choisit la meilleure branche (HeaderStore) et fixe la cible
+    - la plage manquante est découpée en morceaux de SYNC_CHUNK_SIZE blocs,
+      demandés en parallèle (REQUEST_BLOCKS) aux pairs dont le tip les couvre
+    - fenêtre de téléchargement : au plus SYNC_WINDOW_CHUNKS morceaux en vol ou
+      en attente au-delà du tip local (tampon de réordonnancement borné)
+    - un morceau en retard, vide ou invalide est redemandé à un autre pair
+    - seuls les blocs de la meilleure branche sont acceptés (hash comparé au header)
+    - les morceaux sont appliqués dans l'ordre des heights (FRENode._handle_blocks)
+
+    Un pair est identifié par sa clé publique P2P ; les requêtes partent sur la
+    dernière socket par laquelle il a répondu. Appelé sous le verrou du node.
+    """
+
+    def __init__(self, node):
+        self.node = node
+        self.peers: Dict[str, dict] = {}      # pubkey -> {"origin", "tip", "failures"}
+        self.target = -1                      # meilleur tip annoncé (height)
+        self.inflight: Dict[int, dict] = {}   # start -> {"end", "peer", "sent_at"}
+        self.buffer: Dict[int, dict] = {}     # start -> {"peer", "blocks"} reçus, en attente de leur tour
+        self.tried: Dict[int, set] = {}       # start -> pairs ayant échoué sur ce morceau
+        self._last_poll = 0.0
+
+    # ======================================
+    #             DÉCOUVERTE DES TIPS
+    # ======================================
+
+    def _local_height(self) -> int:
+        """Prochain height attendu (= nombre de blocs locaux)."""
+        return self.node.ledger.count_blocks()
+
+    def request_headers(self, force: bool = False):
+        """Demande à tous les pairs leurs headers au-delà du tip local (au plus une fois par SYNC_POLL_SEC)."""
+        now = time.time()
+        if not force and now - self._last_poll < SYNC_POLL_SEC:
+            return
+        self._last_poll = now
+        start = self._local_height()
+        self.node._broadcast_async("REQUEST_HEADERS", {"from": start, "to": start + SYNC_HEADERS_MAX})
+
+    def on_tip(self, peer: str, origin, tip: int):
+        """Un pair (headers validés par l'appelant) annonce son tip : il peut servir les blocs jusque-là."""
+        if not peer or origin is None or not isinstance(tip, int):
+            return
+        info = self.peers.setdefault(peer, {"failures": 0})
+        info["origin"] = origin
+        info["tip"] = tip
+        info["failures"] = 0
+        self._schedule()
+
+    def set_target(self, height: int):
+        """Tip de la meilleure branche de headers : corps à télécharger jusque-là."""
+        if height > self.target:
+            print(f"[SYNC] Cible #{height} (local #{self._local_height() - 1}), synchronisation")
+        self.target = height
+        self._schedule()
+
+    # ======================================
+    #             TÉLÉCHARGEMENT
+    # ======================================
+
+    def _chunk_end(self, start: int) -> Optional[int]:
+        """Fin (exclue) du morceau en vol ou en tampon qui couvre `start`, sinon None."""
+        for s, req in self.inflight.items():
+            if s <= start < req["end"]:
+                return req["end"]
+        for s, chunk in self.buffer.items():
+            if s <= start < s + len(chunk["blocks"]):
+                return s + len(chunk["blocks"])
+        return None
+
+    def _pick_peer(self, start: int, end: int) -> Optional[str]:
+        load = {}
+        for req in self.inflight.values():
+            load[req["peer"]] = load.get(req["peer"], 0) + 1
+        avoid = self.tried.get(start, set())
+        candidates = [
+            p for p, info in self.peers.items()
+            if info.get("tip", -1) >= end - 1
+            and info["failures"] < SYNC_MAX_PEER_FAILURES
+            and load.get(p, 0) < SYNC_MAX_INFLIGHT_PER_PEER
+        ]
+        if not candidates:
+            return None
+        # pair le moins chargé, en évitant ceux qui ont déjà échoué sur ce morceau
+        return min(candidates, key=lambda p: (p in avoid, load.get(p, 0), self.peers[p]["failures"]))
+
+    def _schedule(self):
+        height = self._local_height()
+        if self.target < height:
+            self._reset()
+            return
+        window_end = min(self.target + 1, height + SYNC_WINDOW_CHUNKS * SYNC_CHUNK_SIZE)
+        start = height
+        while start < window_end:
+            end = self._chunk_end(start)
+            if end is not None:
+                start = end
+                continue
+            end = min(start + SYNC_CHUNK_SIZE, window_end)
+            peer = self._pick_peer(start, end)
+            if peer is None:
+                return  # aucun pair libre : la suite attendra une réponse ou un timeout
+            self.inflight[start] = {"end": end, "peer": peer, "sent_at": time.time()}
+            self.node._reply_async(self.peers[peer]["origin"], "REQUEST_BLOCKS", {"from": start, "to": end})
+            start = end
+
+    def _fail(self, start: int, peer: str):
+        self.tried.setdefault(start, set()).add(peer)
+        if peer in self.peers:
+            self.peers[peer]["failures"] += 1
+
+    def on_blocks(self, peer: str, blocks: list):
+        """Réponse BLOCKS : morceau attendu -> tampon puis application dans l'ordre."""
+        blocks = sorted(
+            (b for b in blocks if isinstance(b, dict) and isinstance(b.get("index"), int)),
+            key=lambda b: b["index"],
+        )
+        start = blocks[0]["index"] if blocks else None
+        best_hash = self.node.ledger.headers.best_hash
+        req = self.inflight.get(start)
+        if req is None or req["peer"] != peer:
+            # réponse non sollicitée (pair legacy) : seuls les blocs de la branche choisie
+            # sur les headers sont appliqués, jamais ceux d'une autre branche
+            chosen = [b for b in blocks if b.get("hash") and b["hash"] == best_hash(b["index"])]
+            if chosen:
+                self.node._handle_blocks(chosen)
+            return
+        del self.inflight[start]
+        run = []
+        for blk in blocks:
+            if blk["index"] != start + len(run) or blk["index"] >= req["end"]:
+                break
+            if blk.get("hash") != best_hash(blk["index"]):
+                break  # autre branche que celle choisie sur les headers
+            run.append(blk)
+        if run:
+            # morceau partiel accepté : le reste sera redemandé par _schedule
+            self.buffer[start] = {"peer": peer, "blocks": run}
+            if len(run) < req["end"] - start:
+                self._fail(start + len(run), peer)
+        else:
+            self._fail(start, peer)
+        self._drain()
+        self._schedule()
+
+    def _drain(self):
+        """Applique les morceaux du tampon qui prolongent la chaîne locale."""
+        while True:
+            height = self._local_height()
+            for s in [s for s, c in self.buffer.items() if s + len(c["blocks"]) <= height]:
+                del self.buffer[s]  # déjà appliqués (gossip)
+            start = next((s for s, c in self.buffer.items() if s <= height < s + len(c["blocks"])), None)
+            if start is None:
+                return
+            chunk = self.buffer.pop(start)
+            self.node._handle_blocks(chunk["blocks"])
+            if self._local_height() == height:
+                # morceau invalide : ce pair est évité pour ce morceau, redemandé à un autre
+                print(f"[SYNC] Blocs #{height}.. de {chunk['peer'][:8]} refusés, morceau redemandé")
+                self._fail(height, chunk["peer"])
+                return
+            self.tried.pop(start, None)
+
+    # ======================================
+    #             TIMEOUTS
+    # ======================================
+
+    def tick(self):
+        """Appelé périodiquement : timeouts, redistribution, découverte des tips."""
+        now = time.time()
+        for start, req in list(self.inflight.items()):
+            if now - req["sent_at"] > SYNC_REQUEST_TIMEOUT_SEC:
+                del self.inflight[start]
+                self._fail(start, req["peer"])
+        self._drain()
+        self._schedule()
+        self.request_headers()
+
+    def _reset(self):
+        self.target = -1
+        self.inflight.clear()
+        self.buffer.clear()
+        self.tried.clear()
+
+    def status(self) -> dict:
+        return {
+            "local_height": self._local_height() - 1,
+            "target": self.target,
+            "inflight": len(self.inflight),
+            "buffered": len(self.buffer),
+            "peers": {p: {"tip": i.get("tip"), "failures": i["failures"]} for p, i in self.peers.items()},
+        }
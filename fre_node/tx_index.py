@@ -0,0 +1,56 @@
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Optional, Tuple
+
+from .config import TX_INDEX_FILE
+from .utils import compute_tx_id
+
+
+class TxIndex:
+    """
+    Persistent tx_id -> (height, position) index of included transactions.
+    Backed by sqlite (stdlib): O(log n) lookups without loading the chain.
+    Tracks the last indexed height so the ledger can catch up after a crash.
+    """
+
+    def __init__(self, path: str = TX_INDEX_FILE):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS txs ("
+                "tx_id TEXT PRIMARY KEY, height INTEGER NOT NULL, position INTEGER NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS txs_height ON txs(height)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+
+    def indexed_height(self) -> int:
+        with self._lock:
+            row = self._db.execute("SELECT value FROM meta WHERE key = 'height'").fetchone()
+        return row[0] if row else -1
+
+    def add_block(self, blk: dict):
+        rows = [(compute_tx_id(tx), blk["index"], pos) for pos, tx in enumerate(blk.get("txs", []))]
+        with self._lock, self._db:
+            # première inclusion conservée (un truncate au-dessus ne doit pas la perdre)
+            self._db.executemany("INSERT OR IGNORE INTO txs (tx_id, height, position) VALUES (?, ?, ?)", rows)
+            self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('height', ?)", (blk["index"],))
+
+    def truncate(self, height: int):
+        """Forget transactions of blocks above height."""
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM txs WHERE height > ?", (height,))
+            self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('height', ?)", (height,))
+
+    def get(self, tx_id: str) -> Optional[Tuple[int, int]]:
+        with self._lock:
+            row = self._db.execute("SELECT height, position FROM txs WHERE tx_id = ?", (tx_id,)).fetchone()
+        return (row[0], row[1]) if row else None
+
+    def close(self):
+        with self._lock:
+            self._db.close()
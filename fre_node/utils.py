@@ -1,6 +1,8 @@
 ﻿import base64
 import hashlib
 import os
+import threading
+from collections import OrderedDict
 from nacl.signing import SigningKey, VerifyKey
 
 # ===========================
@@ -167,3 +169,140 @@ def sign_message_raw(priv_b64: str, message: bytes) -> str:
 def verify_signature_p2p(pubkey_b64: str, message: bytes, signature_b64: str) -> bool:
     return verify_signature_raw(pubkey_b64, message, signature_b64)
 
+
+
+# ===========================
+# CACHE LRU BORNÉ
+# ===========================
+
+class LRUCache:
+    """
+    Cache LRU de taille fixe (OrderedDict), l'entrée la moins récemment lue sort en premier.
+    Protégé par un verrou : partagé entre le thread P2P et les threads de l'API.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = max(0, int(maxsize))
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        if self.maxsize == 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            return self._data.pop(key, default)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+
+# ===========================
+# MERKLE (TX DU BLOC)
+# ===========================
+
+def merkle_parent(left: str, right: str) -> str:
+    """Noeud parent de l'arbre des tx_id (Block.merkle_root_from_ids / merkle_proof)."""
+    return hashlib.sha256((left + right).encode()).hexdigest()
+
+
+def verify_merkle_proof(tx_id: str, merkle_root: str, position: int, proof: list) -> bool:
+    """
+    Vérifie une preuve d'inclusion (Block.merkle_proof) : la tx `tx_id` est à la
+    position `position` du bloc de racine merkle_root.
+    """
+    node = tx_id
+    idx = position
+    for sibling in proof:
+        node = merkle_parent(node, sibling) if idx % 2 == 0 else merkle_parent(sibling, node)
+        idx //= 2
+    return idx == 0 and node == merkle_root
+
+
+# ===========================
+# STATE ROOT – SPARSE MERKLE TREE
+# ===========================
+# Feuille : sha256(0x00 | sha256(adresse) | "balance|nonce")
+# Noeud   : sha256(0x01 | gauche | droite), sous-arbre vide = 32 octets nuls
+
+SMT_EMPTY = b"\x00" * 32
+
+
+def smt_key(address: str) -> bytes:
+    return hashlib.sha256(address.encode()).digest()
+
+
+def smt_leaf_hash(key: bytes, balance: int, nonce: int) -> bytes:
+    return hashlib.sha256(b"\x00" + key + f"{balance}|{nonce}".encode()).digest()
+
+
+def smt_node_hash(left: bytes, right: bytes) -> bytes:
+    return hashlib.sha256(b"\x01" + left + right).digest()
+
+
+def smt_bit(key: bytes, depth: int) -> int:
+    """Bit `depth` de la clé (MSB en premier) : 0 = gauche, 1 = droite."""
+    return (key[depth >> 3] >> (7 - (depth & 7))) & 1
+
+
+def verify_state_proof(state_root: str, address: str, balance: int, nonce: int, proof: dict) -> bool:
+    """
+    Vérifie qu'un compte (balance, nonce) est bien dans l'état de racine state_root
+    (réponse de /v1/address/{addr}/proof). Un compte absent se prouve avec
+    balance = nonce = 0 et une feuille vide ou appartenant à une autre adresse.
+    """
+    try:
+        key = smt_key(address)
+        siblings = [bytes.fromhex(h) for h in proof.get("siblings", [])]
+        leaf = proof.get("leaf")
+        depth = len(siblings)
+        if depth > 256:
+            return False
+
+        if leaf is None:
+            if balance != 0 or nonce != 0:
+                return False
+            node = SMT_EMPTY
+        else:
+            leaf_key = bytes.fromhex(leaf["key"])
+            if leaf_key == key:
+                if leaf.get("balance") != balance or leaf.get("nonce") != nonce:
+                    return False
+            else:
+                # autre compte sur le chemin : prouve l'absence, préfixe commun obligatoire
+                if balance != 0 or nonce != 0 or len(leaf_key) != 32:
+                    return False
+                if any(smt_bit(leaf_key, d) != smt_bit(key, d) for d in range(depth)):
+                    return False
+            node = smt_leaf_hash(leaf_key, leaf["balance"], leaf["nonce"])
+
+        for d in range(depth - 1, -1, -1):
+            if smt_bit(key, d):
+                node = smt_node_hash(siblings[d], node)
+            else:
+                node = smt_node_hash(node, siblings[d])
+        return node.hex() == state_root
+    except Exception:
+        return False
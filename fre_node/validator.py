@@ -1,6 +1,6 @@
 import base64
-import hashlib
 import time
+from typing import List
 
 from .config import (
     INITIAL_BALANCE,
@@ -8,14 +8,19 @@ from .config import (
     MIN_FEE,
     TX_VERSION,
     CHAIN_ID,
+    SIG_CACHE_SIZE,
 )
-from .utils import ton_decode, verify_signature, canonical_tx_message
+from .utils import ton_decode, compute_tx_id, LRUCache
 from .state import get_global_state
+from .verification import check_tx_signature, verify_tx_signatures
 
 
 class Validator:
     """
     Validation stricte des transactions.
+    Les signatures déjà vérifiées sont mémorisées par tx_id (LRU) : une tx vue
+    en gossip puis dans un bloc n'est vérifiée qu'une fois ; nonce et balance
+    sont toujours recontrôlés contre l'état courant.
     """
 
     ALLOWED_TYPES = {"transfer"}
@@ -23,12 +28,70 @@ class Validator:
 
     def __init__(self):
         self.state = get_global_state()
+        self.sig_cache = LRUCache(SIG_CACHE_SIZE)  # tx_id -> pubkey vérifiée
 
     def _decode_pubkey(self, pubkey_b64: str):
         padded = pubkey_b64 + "=" * ((4 - len(pubkey_b64) % 4) % 4)
         return base64.urlsafe_b64decode(padded)
 
-    def validate_transaction(self, tx: dict) -> bool:
+    def validate_transaction(self, tx: dict, pending_nonce: int = None) -> bool:
+        """
+        pending_nonce : prochain nonce libre côté mempool (Mempool.next_nonce) ;
+        tout nonce dans [nonce du state, pending_nonce] est alors accepté pour
+        être mis en file. Sans lui, seul le nonce du state est valide (bloc).
+        """
+        if not self.check_stateless(tx):
+            return False
+        if not self.check_state(tx, pending_nonce):
+            return False
+        if not DEV_MODE and not self._check_signature(tx):
+            print("[VALIDATOR] Signature invalide.")
+            return False
+        return True
+
+    def _check_signature(self, tx: dict) -> bool:
+        tx_id = compute_tx_id(tx)
+        # tx_id couvre message + signature ; la pubkey doit aussi être celle déjà vérifiée
+        if self.sig_cache.get(tx_id) == tx["pubkey"]:
+            return True
+        if not check_tx_signature(tx):
+            return False
+        self.sig_cache.put(tx_id, tx["pubkey"])
+        return True
+
+    def validate_transactions(self, txs: List[dict], check_clock: bool = True) -> List[bool]:
+        """
+        Validation par lot : contrôles sans état puis signatures Ed25519 vérifiées
+        ensemble (pool de process au-delà de VERIFY_PARALLEL_MIN tx).
+        Retourne un verdict par tx. Nonce et balance dépendent de l'ordre
+        d'application : l'appelant les contrôle ensuite avec check_state.
+        check_clock=False pour les tx d'un bloc (voir check_stateless).
+        """
+        verdicts = [isinstance(tx, dict) and self.check_stateless(tx, check_clock) for tx in txs]
+        if DEV_MODE:
+            return verdicts
+        to_verify = []
+        for pos, ok in enumerate(verdicts):
+            if not ok:
+                continue
+            tx_id = compute_tx_id(txs[pos])
+            if self.sig_cache.get(tx_id) != txs[pos]["pubkey"]:
+                to_verify.append((pos, tx_id))
+        results = verify_tx_signatures([txs[pos] for pos, _ in to_verify])
+        for (pos, tx_id), ok in zip(to_verify, results):
+            if ok:
+                self.sig_cache.put(tx_id, txs[pos]["pubkey"])
+            else:
+                print("[VALIDATOR] Signature invalide.")
+                verdicts[pos] = False
+        return verdicts
+
+    def check_stateless(self, tx: dict, check_clock: bool = True) -> bool:
+        """
+        Format, version, chain_id, horodatage, adresses, montant et fee.
+        L'écart à l'horloge locale ne compte qu'à l'admission en mempool : une tx
+        incluse dans un bloc (synchronisation de l'historique) peut être ancienne.
+        """
         required = [
             "version",
             "type",
@@ -62,17 +125,15 @@ class Validator:
             print("[VALIDATOR] Timestamp invalide.")
             return False
         now = int(time.time())
-        if abs(now - ts) > self.MAX_CLOCK_SKEW_SEC:
+        if check_clock and abs(now - ts) > self.MAX_CLOCK_SKEW_SEC:
             print("[VALIDATOR] Timestamp trop eloigne.")
             return False
 
-        try:
-            sender_pubkey_hash = ton_decode(tx["from"])
-            ton_decode(tx["to"])
-        except Exception:
-            if DEV_MODE:
-                sender_pubkey_hash = b""
-            else:
+        if not DEV_MODE:
+            try:
+                ton_decode(tx["from"])
+                ton_decode(tx["to"])
+            except Exception:
                 print("[VALIDATOR] Adresse TON invalide.")
                 return False
 
@@ -83,9 +144,23 @@ class Validator:
             print("[VALIDATOR] Fee invalide.")
             return False
 
+        if not DEV_MODE:
+            try:
+                self._decode_pubkey(tx["pubkey"])
+            except Exception:
+                print("[VALIDATOR] Pubkey invalide.")
+                return False
+        return True
+
+    def check_state(self, tx: dict, pending_nonce: int = None) -> bool:
+        """Nonce et balance contre l'état courant (voir validate_transaction pour pending_nonce)."""
         expected_nonce = self.state.get_nonce(tx["from"])
-        if tx["nonce"] != expected_nonce:
-            print(f"[VALIDATOR] Nonce incorrect. Attendu : {expected_nonce}")
+        max_nonce = expected_nonce if pending_nonce is None else max(pending_nonce, expected_nonce)
+        if not isinstance(tx["nonce"], int) or not expected_nonce <= tx["nonce"] <= max_nonce:
+            if max_nonce == expected_nonce:
+                print(f"[VALIDATOR] Nonce incorrect. Attendu : {expected_nonce}")
+            else:
+                print(f"[VALIDATOR] Nonce incorrect. Attendu : {expected_nonce}..{max_nonce}")
             return False
 
         if DEV_MODE:
@@ -96,19 +171,7 @@ class Validator:
                 return False
             return True
 
-        try:
-            pubkey_raw = self._decode_pubkey(tx["pubkey"])
-        except Exception:
-            print("[VALIDATOR] Pubkey invalide.")
-            return False
-
         if self.state.get_balance(tx["from"]) < tx["amount"] + tx["fee"]:
             print("[VALIDATOR] Balance insuffisante.")
             return False
-
-        message = canonical_tx_message(tx)
-        if not verify_signature(sender_pubkey_hash, message, tx["signature"], pubkey_raw):
-            print("[VALIDATOR] Signature invalide.")
-            return False
-
         return True
@@ -63,13 +63,21 @@ def select_producer(height: int, validators: List[Dict], weighted: bool = True)
     if not weighted:
         return validators[height % len(validators)]["name"]
 
-    expanded = []
+    # équivalent à répéter chaque validateur `stake` fois, sans construire la liste
+    slot = height % total_stake(validators)
     for v in validators:
-        stake = max(1, int(v.get("stake", 1)))
-        expanded.extend([v["name"]] * stake)
-    if not expanded:
-        return NODE_NAME
-    return expanded[height % len(expanded)]
+        slot -= max(1, int(v.get("stake", 1)))
+        if slot < 0:
+            return v["name"]
+    return NODE_NAME
+
+
+def stake_of(validators: List[Dict], producer: str) -> int:
+    """Stake d'un producteur désigné par son nom (blocs) ou sa pubkey (headers P2P) ; 0 si inconnu."""
+    for v in validators:
+        if producer and producer in (v.get("name"), v.get("pubkey")):
+            return max(1, int(v.get("stake", 1)))
+    return 0
 
 
 def get_pubkey(validators: List[Dict], name: str):
@@ -0,0 +1,130 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from typing import Dict, List, Optional, Tuple
+
+from .block import Block
+from .config import BLOCK_REWARD, VERIFY_WORKERS, VERIFY_PARALLEL_MIN
+from .utils import (
+    compute_tx_id,
+    verify_signature_raw,
+    verify_signature,
+    ton_decode,
+    b64url_decode,
+    canonical_tx_message,
+)
+from .validator_set import select_producer, get_pubkey
+
+# Pool créé à la première vérification parallèle, partagé par le ledger, le consensus et le validateur.
+# Jamais par fork : à ce moment le node a déjà ses threads (API, executor, P2P) et un
+# process forké hériterait de leurs verrous dans un état quelconque.
+_POOL = None
+_START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+
+def get_pool() -> Optional[ProcessPoolExecutor]:
+    global _POOL
+    if _POOL is None and VERIFY_WORKERS > 1:
+        _POOL = ProcessPoolExecutor(
+            max_workers=VERIFY_WORKERS,
+            mp_context=multiprocessing.get_context(_START_METHOD),
+        )
+    return _POOL
+
+
+def check_block(blk: dict, validators: List[Dict]) -> Optional[str]:
+    """
+    Stateless checks of one block: everything except the prev_hash link.
+    Returns the failure reason (same wording as the ledger errors) or None.
+    """
+    try:
+        block_obj = Block.from_dict(blk)
+    except Exception:
+        return "malformed block"
+
+    txs = blk.get("txs", [])
+    tx_ids = [compute_tx_id(tx) for tx in txs]
+    if len(tx_ids) != len(set(tx_ids)):
+        return "contains duplicate tx"
+    fees_sum = sum(tx.get("fee", 0) for tx in txs)
+    if blk.get("total_fees", 0) != fees_sum:
+        return "invalid total_fees"
+    if blk.get("block_reward", 0) != (BLOCK_REWARD if BLOCK_REWARD else 0):
+        return "invalid block_reward"
+
+    # recalculé depuis les tx : Block.from_dict reprend le merkle_root fourni tel quel
+    if blk.get("merkle_root") and blk.get("merkle_root") != Block.merkle_root_from_ids(tx_ids):
+        return "invalid merkle_root"
+    if blk.get("hash") != block_obj.hash:
+        return "invalid hash"
+
+    # producer check + signature (skip genesis)
+    if blk.get("index", 0) > 0:
+        if blk.get("validator") != select_producer(blk["index"], validators, weighted=True):
+            return "invalid producer"
+        pubkey = get_pubkey(validators, blk.get("validator"))
+        if not pubkey or not blk.get("block_signature"):
+            return "missing pubkey or signature"
+        if not verify_signature_raw(pubkey, block_obj.hash.encode(), blk["block_signature"]):
+            return "invalid block signature"
+    return None
+
+
+def first_broken_link(blocks: List[dict], prev_hash: Optional[str]) -> Optional[int]:
+    """Position of the first block whose prev_hash does not follow (in order), or None."""
+    for pos, blk in enumerate(blocks):
+        if prev_hash is not None and blk.get("prev_hash") != prev_hash:
+            return pos
+        prev_hash = blk.get("hash")
+    return None
+
+
+def verify_blocks(blocks: List[dict], validators: List[Dict]) -> Optional[Tuple[int, str]]:
+    """
+    Run check_block over a batch, spread over the process pool when it is large
+    enough. Returns (position, reason) of the first bad block, or None.
+    """
+    pool = get_pool() if len(blocks) >= VERIFY_PARALLEL_MIN else None
+    if pool is None:
+        results = (check_block(blk, validators) for blk in blocks)
+    else:
+        chunksize = max(1, len(blocks) // (VERIFY_WORKERS * 4))
+        results = pool.map(check_block, blocks, repeat(validators), chunksize=chunksize)
+    for pos, reason in enumerate(results):
+        if reason:
+            return pos, reason
+    return None
+
+
+def verify_chain_segment(blocks: List[dict], prev_hash: Optional[str], validators: List[Dict]) -> Optional[Tuple[int, str]]:
+    """
+    Full check of consecutive blocks: links in order, then bodies in parallel.
+    Returns (position, reason) of the first bad block, or None.
+    """
+    link_pos = first_broken_link(blocks, prev_hash)
+    checked = blocks if link_pos is None else blocks[:link_pos + 1]
+    bad = verify_blocks(checked, validators)
+    if bad:
+        return bad
+    if link_pos is not None:
+        return link_pos, "invalid chain link"
+    return None
+
+
+def check_tx_signature(tx: dict) -> bool:
+    """Ed25519 check of one transaction: pubkey matches the `from` address and signs the canonical message."""
+    try:
+        sender_pubkey_hash = ton_decode(tx["from"])
+        pubkey_raw = b64url_decode(tx["pubkey"])
+        return verify_signature(sender_pubkey_hash, canonical_tx_message(tx), tx["signature"], pubkey_raw)
+    except Exception:
+        return False
+
+
+def verify_tx_signatures(txs: List[dict]) -> List[bool]:
+    """Per-tx signature verdicts, spread over the process pool for large batches."""
+    pool = get_pool() if len(txs) >= VERIFY_PARALLEL_MIN else None
+    if pool is None:
+        return [check_tx_signature(tx) for tx in txs]
+    chunksize = max(1, len(txs) // (VERIFY_WORKERS * 4))
+    return list(pool.map(check_tx_signature, txs, chunksize=chunksize))
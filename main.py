@@ -1,5 +1,7 @@
+import argparse
 import sys
 import os
+from fre_node.config import FULL_VERIFY
 from fre_node.node import FRENode
 
 # Ajoute le chemin du package interne
@@ -7,5 +9,19 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(os.path.join(BASE_DIR, "fre_node"))
 
 if __name__ == "__main__":
-    node = FRENode()
-    node.start()
+    parser = argparse.ArgumentParser(description="FRE node")
+    parser.add_argument(
+        "--full-verify",
+        action="store_true",
+        help="revalide tous les blocs au démarrage (ignore le checkpoint)",
+    )
+    parser.add_argument(
+        "--check-only",
+        action="store_true",
+        help="charge et valide le node puis quitte (utilisé par update_node.sh)",
+    )
+    args = parser.parse_args()
+
+    node = FRENode(full_verify=args.full_verify or FULL_VERIFY)
+    if not args.check_only:
+        node.start()